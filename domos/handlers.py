@@ -1,45 +1,25 @@
 import operator as op
+import re
 from plyplus import Grammar, STransformer
 import threading
+import time
+import datetime
+import copy
 import queue as qu
+from collections import deque, namedtuple
 import domos.util.domossettings as ds
 from domos.util.domossettings import domosSettings
 from domos.util.db import *
+from domos.util.expression import GRAMMAR
+import domos.util.expression as expressions
 import peewee
 from pprint import pprint
 import logging
 
-GRAMMAR = """
-    start: lgc;             // This is the top of the hierarchy
-    ?lgc: ( lgc lgc_symbol )? eql;
-    ?eql: ( eql eql_symbol )? add;
-    ?add: ( add add_symbol )? mul;
-    ?mul: ( mul mul_symbol )? exp;
-    ?exp: ( exp exp_symbol )? atom;
-    @atom: neg | number | string | sensor | trigger | true_symbol | false_symbol | parenthesis;
-    parenthesis: popen_sym add pclose_sym;
-    neg: '-' atom;
-    true_symbol: 'True' | 'true' | 'Yes' | 'yes';
-    false_symbol: 'False' | 'false' | 'No' | 'no';
-    string: '[\"]\w+[\"]';
-    number: '[\d.]+';           // Regular expression for a decimal number
-    sensor: '__sens\d+__';      // Sensor database match
-    trigger: '__trig\d+__';     // trigger database match
-    macro: '__macr\d+__';       // macro database match
-    mul_symbol: '\*' | '/' | '//' | '%'; // Match * or / or %
-    add_symbol: '\+' | '-'; // Match + or -
-    exp_symbol: '\*\*';
-    eql_symbol: '==' | '<=' | '!=' | '>=' |'<' | '>';
-    lgc_symbol: '\|\|' | '\&\&';
-    bit_symbol: '\|' | '\&' | '\^';
-    popen_sym: '\(';
-    pclose_sym: '\)';
-    WHITESPACE: '[ \t]+' (%ignore);
-"""
 
 
 class triggerChecker(threading.Thread):
-    def __init__(self, queue=None, loghandler=None, loglevel=None):
+    def __init__(self, queue=None, loghandler=None, loglevel=None, cascade=None):
         """
         triggerchecker thread class.
         keeps watching a queue for sensor or triggers that changed and
@@ -47,10 +27,16 @@ class triggerChecker(threading.Thread):
          - queue: a queue object to use as a queue to watch. if none 
          given one is created
          - logger: a logger object to use. Usually a rpc object is ok.
+         - cascade: evaluate all depending triggers of an item in a single
+         pass in topological order. if none given the core config is used
         """
         threading.Thread.__init__(self)
         self.actionqueue = None
+        if cascade is None:
+            cascade = domosSettings.get_core_config()['cascade']
+        self.cascade = cascade
         self.shutdown = False
+        self.stopping = False
         self.logger = logging.getLogger('Trigger')
         if loglevel:
             self.logger.setLevel(loglevel)
@@ -69,6 +55,8 @@ class triggerChecker(threading.Thread):
             self.db = dbhandler()
             self.db.connect()
             self.calculator = matchcalculator(self.db, grammar=GRAMMAR)
+            self.index = triggerindex()
+            self.index.build()
         except:
             self.logger.critical("Could not connect to database, shutting down")
             self.shutdown = True
@@ -85,21 +73,72 @@ class triggerChecker(threading.Thread):
         """
         self.actionqueue = queue
 
-    def _checktrigger(self, trigger, item):
+    def trigger_added(self, trigger):
         """
-        Checks a single trigger
+        Add or update a trigger in the dependency index
+         - trigger: ID of the added or changed trigger
+        """
+        self.q.put(("addtrigger", trigger, None))
+
+    def trigger_removed(self, trigger):
+        """
+        Remove a trigger from the dependency index
+         - trigger: ID of the removed trigger
+        """
+        self.q.put(("deltrigger", trigger, None))
+
+    def triggers_reloaded(self):
+        """
+        Rebuild the dependency index from the database
+        """
+        self.q.put(("rebuildtriggers", None, None))
+
+    def _checktrigger(self, trigger, item, propagate=True):
+        """
+        Checks a single trigger, returns True if the value of the trigger changed
+         - propagate: put the changed trigger back on the queue to check
+         the triggers depending on it
         """
         type, id, value = item
         match = trigger.expression
         # TODO: add function dict
-        triggervalue = self.calculator.resolve(match, item)
-        print("New:", triggervalue, "old:", trigger.lastvalue)
-        if trigger.lastvalue != triggervalue:
+        try:
+            triggervalue = float(self.calculator.resolve(match, item))
+        except (TypeError, ValueError, ZeroDivisionError) as err:
+            self.logger.warning("Could not evaluate trigger {0}: {1}".format(trigger.id, err))
+            return False
+        self.logger.debug("Trigger {0} evaluated to {1}, was {2}".format(trigger.id, triggervalue, trigger.current))
+        if trigger.current != triggervalue:
             self.logger.debug("Trigger {0} now has value {1}".format(trigger.id, triggervalue))
             trigger.add_value(triggervalue)
-            self.q.put(("trigger", trigger.id, triggervalue))
+            if propagate:
+                self.q.put(("trigger", trigger.id, triggervalue))
             if self.actionqueue:
                 self.actionqueue.put(("trigger", trigger.id, triggervalue))
+            return True
+        return False
+
+    def _cascade(self, item):
+        """
+        Checks all triggers depending on an item once, in topological order.
+        A trigger is only checked when the item or one of its source triggers changed.
+        """
+        type, id, value = item
+        try:
+            if type == "sensor":
+                direct = self.index.bysensor.get(int(id), set())
+                order = self.index.cascade(sensor=id)
+            else:
+                direct = self.index.bytrigger.get(int(id), set())
+                order = self.index.cascade(trigger=id)
+        except cycleerror as err:
+            self.logger.error(err.message)
+            return
+        changed = set()
+        for trigger in order:
+            if trigger.id in direct or self.index.sources[trigger.id][1] & changed:
+                if self._checktrigger(trigger, item, propagate=False):
+                    changed.add(trigger.id)
 
     def processitem(self, item):
         """
@@ -109,10 +148,28 @@ class triggerChecker(threading.Thread):
         """
         type, id, value = item
         self.logger.debug("Receiving item message")
-        if type == "sensor":
-            triggers = Trigger.get_affected_by_sensor(id)
+        triggers = []
+        if type == "addtrigger":
+            try:
+                # load the expression too, the indexed trigger is used to check the trigger
+                trigger = Trigger.select(Trigger, Expression).join(Expression).where(Trigger.id == id).get()
+            except DoesNotExist:
+                self.index.remove_trigger(id)
+                return
+            try:
+                self.index.add_trigger(trigger)
+            except cycleerror as err:
+                self.logger.error(err.message)
+        elif type == "deltrigger":
+            self.index.remove_trigger(id)
+        elif type == "rebuildtriggers":
+            self.index.build()
+        elif self.cascade:
+            self._cascade(item)
+        elif type == "sensor":
+            triggers = self.index.affected_by_sensor(id)
         elif type == "trigger":
-            triggers = Trigger.get_affected_by_trigger(id)
+            triggers = self.index.affected_by_trigger(id)
         for trigger in triggers:
             self._checktrigger(trigger, item)
 
@@ -120,19 +177,753 @@ class triggerChecker(threading.Thread):
         """
         standard run loop
         """
-        while not self.shutdown:
+        while not (self.shutdown or (self.stopping and self.q.empty())):
             try:
                 item = self.q.get(timeout=2)
                 self.processitem(item)
             except qu.Empty:
                 pass
 
+    def end(self):
+        """
+        Stop the trigger checker after checking the queued items
+        """
+        self.stopping = True
+
+
+class coalescingQueue(qu.Queue):
+    """Trigger queue which collapses the pending updates of coalesced sensors
+    to the latest value. The update keeps its place in the queue.
+    """
+
+    def __init__(self, maxsize=0, sensors=()):
+        """
+         - maxsize: maximum size of the queue
+         - sensors: IDs of the sensors to coalesce
+        """
+        qu.Queue.__init__(self, maxsize)
+        self.sensors = {int(sensor) for sensor in sensors}
+
+    def set_coalesce(self, sensor, coalesce=True):
+        """
+        Enable or disable coalescing for a sensor
+         - sensor: ID of the sensor
+         - coalesce: whether to coalesce the updates of the sensor
+        """
+        with self.mutex:
+            if coalesce:
+                self.sensors.add(int(sensor))
+            else:
+                self.sensors.discard(int(sensor))
+
+    def _init(self, maxsize):
+        self.queue = deque()
+        self.pending = {}
+
+    def _put(self, item):
+        type, id, value = item
+        if type == "sensor" and int(id) in self.sensors:
+            entry = self.pending.get(int(id))
+            if entry:
+                entry[2] = value
+                # put() counts the collapsed update as a new task
+                self.unfinished_tasks -= 1
+                return
+            entry = [type, id, value]
+            self.pending[int(id)] = entry
+            item = entry
+        self.queue.append(item)
+
+    def _get(self):
+        item = self.queue.popleft()
+        if isinstance(item, list):
+            del self.pending[int(item[1])]
+            item = tuple(item)
+        return item
+
+
+sensormeta = namedtuple('sensormeta', ['id', 'name', 'active', 'instant', 'coalesce', 'numeric', 'module'])
+
+
+class sensorCache:
+    """Process wide cache of the sensor metadata, maps the sensor ID to a
+    sensormeta tuple. The ingest path uses this instead of querying the
+    :class:`Sensor` table for every value.
+    """
+    sensors = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def _meta(sensor):
+        return sensormeta(sensor.id, sensor.name, sensor.active, sensor.instant,
+                          sensor.coalesce, sensor.numeric, sensor.modulerpc.module.id)
+
+    @classmethod
+    def load(cls):
+        """Load the metadata of all sensors in a single query
+        """
+        sensors = Sensor.select(Sensor, ModuleRPC, Module).join(ModuleRPC).join(Module)
+        with cls.lock:
+            cls.sensors = {sensor.id: cls._meta(sensor) for sensor in sensors}
+
+    @classmethod
+    def get(cls, sensor):
+        """Returns the metadata of a sensor, the sensor is looked up in the
+        database when it is not cached. Raises DoesNotExist for unknown sensors.
+
+        :param sensor: ID of the sensor
+        """
+        sensor = int(sensor)
+        meta = cls.sensors.get(sensor)
+        if not meta:
+            meta = cls._meta(Sensor.select(Sensor, ModuleRPC, Module).join(ModuleRPC).join(Module)
+                             .where(Sensor.id == sensor).get())
+            with cls.lock:
+                cls.sensors[sensor] = meta
+        return meta
+
+    @classmethod
+    def invalidate(cls, sensor=None):
+        """Remove a sensor from the cache, removes all sensors if none is given
+
+        :param sensor: ID of the sensor
+        """
+        with cls.lock:
+            if sensor is None:
+                cls.sensors = {}
+            else:
+                cls.sensors.pop(int(sensor), None)
+
+
+class valueWriter(threading.Thread):
+    """Write behind buffer for sensor values. Values are collected and inserted
+    in a single transaction every size values or after interval milliseconds.
+    """
+
+    def __init__(self, size=None, interval=None, maxsize=None, loghandler=None, loglevel=None):
+        """
+         - size: number of values to collect before writing them
+         - interval: maximum time in milliseconds a value is buffered
+         - maxsize: maximum number of buffered values, adding values blocks when full
+        """
+        threading.Thread.__init__(self)
+        self.shutdown = False
+        self.logger = logging.getLogger('Writer')
+        if loglevel:
+            self.logger.setLevel(loglevel)
+        else:
+            self.logger.setLevel(domosSettings.getLoggingLevel('Writer'))
+        if loghandler:
+            self.logger.addHandler(loghandler)
+        cfg = domosSettings.get_core_config()
+        self.size = size or cfg['writebuffer_size']
+        self.interval = (interval or cfg['writebuffer_interval']) / 1000
+        self.q = qu.Queue(maxsize or cfg['writebuffer_max'])
+        self.lock = threading.Lock()
+        self.unwritten = []
+
+    def put(self, sensor, value, timestamp=None):
+        """
+        Add a value to the buffer, blocks while the buffer is full
+         - sensor: ID of the sensor
+         - value: the value to write, floats are stored as numeric values
+         - timestamp: time of the value, the current time if not given
+        """
+        row = (int(sensor), value, timestamp or datetime.datetime.now())
+        with self.lock:
+            self.unwritten.append(row)
+        self.q.put(row)
+
+    def pending(self, sensor):
+        """
+        Returns the values of a sensor not yet written, newest first
+         - sensor: ID of the sensor
+        """
+        with self.lock:
+            return [SensorValue(**SensorValue.row(*row)) for row in reversed(self.unwritten) if row[0] == int(sensor)]
+
+    def flush(self, rows):
+        """
+        Write a list of (sensor, value, timestamp) tuples in a single transaction,
+        returns the rows that could not be written
+        """
+        remaining = self._write(rows)
+        kept = {id(row) for row in remaining}
+        written = {id(row) for row in rows if id(row) not in kept}
+        with self.lock:
+            self.unwritten = [row for row in self.unwritten if id(row) not in written]
+        return remaining
+
+    def _write(self, rows):
+        store = SensorValue.store
+        if store is not None:
+            # values older than the last stored value of a sensor can only be stored in the database
+            remaining = []
+            for position, row in enumerate(rows):
+                sensor, value, timestamp = row
+                try:
+                    if not (isinstance(value, float) and store.append(sensor, value, timestamp)):
+                        remaining.append(row)
+                except OSError as err:
+                    self.logger.error("Could not append sensor values to the column store: {}".format(err))
+                    remaining.extend(rows[position:])
+                    break
+            rows = remaining
+            try:
+                store.flush()
+            except OSError as err:
+                self.logger.error("Could not flush the column store: {}".format(err))
+        try:
+            values = [SensorValue.row(sensor, value, timestamp) for sensor, value, timestamp in rows]
+            with dbconn.transaction():
+                for table, tablerows in SensorValue.split(values):
+                    for start in range(0, len(tablerows), 250):
+                        table.insert_many(tablerows[start:start + 250]).execute()
+        except peewee.DatabaseError as err:
+            self.logger.error("Could not write {} sensor values, retrying: {}".format(len(rows), err))
+            return rows
+        self.logger.debug("Wrote {} sensor values".format(len(rows)))
+        return []
+
+    def run(self):
+        self.db = dbhandler()
+        self.db.connect()
+        rows = []
+        deadline = None
+        failed = False
+        while not (self.shutdown and (failed or self.q.empty())):
+            if rows:
+                timeout = max(0, deadline - time.monotonic())
+            else:
+                timeout = self.interval
+            # wake up at least every second to notice the shutdown
+            timeout = min(timeout, 1)
+            if failed and self.q.maxsize and len(rows) >= self.q.maxsize:
+                # keep the values which could not be written, put() blocks until the database is back
+                time.sleep(timeout)
+            else:
+                try:
+                    rows.append(self.q.get(timeout=timeout))
+                    if len(rows) == 1:
+                        deadline = time.monotonic() + self.interval
+                except qu.Empty:
+                    pass
+            # after a failed write the values are retried on the next interval
+            if rows and ((len(rows) >= self.size and not failed) or time.monotonic() >= deadline):
+                rows = self.flush(rows)
+                failed = bool(rows)
+                deadline = time.monotonic() + self.interval
+        while not self.q.empty():
+            rows.append(self.q.get_nowait())
+        if rows:
+            rows = self.flush(rows)
+        if rows:
+            self.logger.error("Lost {} sensor values on shutdown".format(len(rows)))
+        self.db.close()
+
+    def end(self):
+        """
+        Stop the writer after writing all buffered values
+        """
+        self.shutdown = True
+
+
+class triggerState(threading.Thread):
+    """Authoritative in memory state of the triggers. Changed trigger values and
+    recorded values are written in a single transaction every interval milliseconds.
+    """
+
+    def __init__(self, interval=None, loghandler=None, loglevel=None):
+        """
+         - interval: maximum time in milliseconds a changed trigger value is not yet written
+        """
+        threading.Thread.__init__(self)
+        self.shutdown = threading.Event()
+        self.logger = logging.getLogger('TriggerState')
+        if loglevel:
+            self.logger.setLevel(loglevel)
+        else:
+            self.logger.setLevel(domosSettings.getLoggingLevel('TriggerState'))
+        if loghandler:
+            self.logger.addHandler(loghandler)
+        cfg = domosSettings.get_core_config()
+        self.interval = (interval or cfg['trigger_flush_interval']) / 1000
+        self.lock = threading.Lock()
+        self.values = {}
+        self.changed = {}
+        self.records = []
+
+    def load(self):
+        """
+        Load the last values of all triggers from the database
+        """
+        with self.lock:
+            self.values = dict(Trigger.select(Trigger.id, Trigger.lastvalue).tuples())
+
+    def get(self, trigger):
+        """
+        Returns the last value of a trigger, None if the trigger has no value
+         - trigger: ID of the trigger
+        """
+        return self.values.get(int(trigger))
+
+    def set(self, trigger, value):
+        """
+        Change the value of a trigger, the value is written on the next flush
+         - trigger: the :class:`Trigger`
+         - value: the new value, a float
+        """
+        with self.lock:
+            self.values[trigger.id] = value
+            self.changed[trigger.id] = value
+            if trigger.record:
+                self.records.append(TriggerValue(trigger=trigger.id, numeric=value,
+                                                 timestamp=datetime.datetime.now()))
+
+    def pending(self, trigger):
+        """
+        Returns the recorded values of a trigger not yet written, newest first
+         - trigger: ID of the trigger
+        """
+        with self.lock:
+            return [record for record in reversed(self.records) if record._data['trigger'] == int(trigger)]
+
+    def flush(self):
+        """
+        Write the changed trigger values and the recorded values in a single transaction
+        """
+        with self.lock:
+            changed, self.changed = self.changed, {}
+            records, self.records = self.records, []
+        if not (changed or records):
+            return
+        rows = [{'trigger': record._data['trigger'], 'value': None,
+                 'numeric': record.numeric, 'timestamp': record.timestamp} for record in records]
+        try:
+            with dbconn.transaction():
+                for trigger, value in changed.items():
+                    Trigger.update(lastvalue=value).where(Trigger.id == trigger).execute()
+                for table, tablerows in TriggerValue.split(rows):
+                    for start in range(0, len(tablerows), 250):
+                        table.insert_many(tablerows[start:start + 250]).execute()
+        except peewee.DatabaseError as err:
+            self.logger.error("Could not write {} trigger values: {}".format(len(changed), err))
+            with self.lock:
+                # keep the values for the next flush, newer changes take precedence
+                changed.update(self.changed)
+                self.changed = changed
+                self.records = records + self.records
+        else:
+            self.logger.debug("Wrote {} trigger values and {} records".format(len(changed), len(records)))
+
+    def run(self):
+        self.db = dbhandler()
+        self.db.connect()
+        stopping = False
+        while not stopping:
+            stopping = self.shutdown.wait(self.interval)
+            self.flush()
+        self.db.close()
+
+    def end(self):
+        """
+        Stop the trigger state after writing the pending values
+        """
+        self.shutdown.set()
+
+
+class rollupHandler(threading.Thread):
+    """Maintains the rollup tables of the sensors. Values are aggregated in
+    memory per period and written every interval seconds. Values of older
+    periods are merged into the pending row of their period, or the stored row
+    if the period was already written.
+    """
+
+    def __init__(self, interval=None, loghandler=None, loglevel=None):
+        """
+         - interval: number of seconds between writes of the aggregated values
+        """
+        threading.Thread.__init__(self)
+        self.shutdown = False
+        self.logger = logging.getLogger('Rollup')
+        if loglevel:
+            self.logger.setLevel(loglevel)
+        else:
+            self.logger.setLevel(domosSettings.getLoggingLevel('Rollup'))
+        if loghandler:
+            self.logger.addHandler(loghandler)
+        self.interval = interval or domosSettings.get_core_config()['rollup_interval']
+        self.q = qu.Queue()
+        self.periods = {}
+        self.dirty = set()
+        self.closed = {}
+
+    def put(self, sensor, value, timestamp):
+        """
+        Add a numeric value to the rollups of a sensor
+         - sensor: ID of the sensor
+         - value: the value, a float
+         - timestamp: time of the value
+        """
+        self.q.put((sensor, value, timestamp))
+
+    @staticmethod
+    def _load(table, sensor, period):
+        try:
+            return table.get((table.sensor == sensor) & (table.timestamp == period))
+        except table.DoesNotExist:
+            return table(sensor=sensor, timestamp=period, total=0, count=0)
+
+    @staticmethod
+    def _update(row, value, late=False):
+        if row.count:
+            row.minimum = min(row.minimum, value)
+            row.maximum = max(row.maximum, value)
+        else:
+            row.minimum = row.maximum = value
+        row.total += value
+        row.count += 1
+        if not late or row.last is None:
+            row.last = value
+
+    def add(self, sensor, value, timestamp):
+        """
+        Add a value to the periods of all rollup tables
+        """
+        for table in rolluptables:
+            key = (table, sensor)
+            period = table.period(timestamp)
+            row = self.periods.get(key)
+            if row is not None and period < row.timestamp:
+                # value of an older period, merged into the row of the period written on the next flush
+                row = self.closed.get((table, sensor, period))
+                if row is None:
+                    row = self._load(table, sensor, period)
+                    self.closed[(table, sensor, period)] = row
+                self._update(row, value, late=True)
+                continue
+            if row is None or row.timestamp != period:
+                if key in self.dirty:
+                    self.closed[(table, sensor, row.timestamp)] = row
+                    self.dirty.discard(key)
+                row = self._load(table, sensor, period)
+                self.periods[key] = row
+            self._update(row, value)
+            self.dirty.add(key)
+
+    def flush(self):
+        """
+        Write the changed periods in a single transaction, the periods are kept
+        for the next flush when they could not be written
+        """
+        rows = list(self.closed.values()) + [self.periods[key] for key in self.dirty]
+        if not rows:
+            return
+        new = [row for row in rows if row.id is None]
+        try:
+            with dbconn.transaction():
+                for row in rows:
+                    row.save()
+        except peewee.DatabaseError as err:
+            self.logger.error("Could not write {} rollups, retrying: {}".format(len(rows), err))
+            # the inserts were rolled back
+            for row in new:
+                row.id = None
+            return
+        self.closed = {}
+        self.dirty = set()
+
+    def run(self):
+        self.db = dbhandler()
+        self.db.connect()
+        deadline = time.monotonic() + self.interval
+        while not self.shutdown:
+            try:
+                # wake up at least every second to notice the shutdown
+                sensor, value, timestamp = self.q.get(timeout=min(1, max(0, deadline - time.monotonic())))
+                self.add(sensor, value, timestamp)
+            except qu.Empty:
+                pass
+            if time.monotonic() >= deadline:
+                self.flush()
+                deadline = time.monotonic() + self.interval
+        while not self.q.empty():
+            self.add(*self.q.get())
+        self.flush()
+        self.db.close()
+
+    def end(self):
+        """
+        Stop the rollup handler after writing the aggregated values
+        """
+        self.shutdown = True
+
+
+class pruneHandler(threading.Thread):
+    """Deletes sensor values, rollups and trigger values older than their
+    retention. Rows are deleted in small batches to keep the locks short.
+    Partitions older than the longest retention are dropped as a whole, the
+    partitions of the current and the next month are created on every run.
+    """
+
+    def __init__(self, interval=None, batch=None, loghandler=None, loglevel=None):
+        """
+         - interval: number of seconds between pruning runs
+         - batch: number of rows to delete per query
+        """
+        threading.Thread.__init__(self)
+        self.shutdown = threading.Event()
+        self.logger = logging.getLogger('Prune')
+        if loglevel:
+            self.logger.setLevel(loglevel)
+        else:
+            self.logger.setLevel(domosSettings.getLoggingLevel('Prune'))
+        if loghandler:
+            self.logger.addHandler(loghandler)
+        cfg = domosSettings.get_core_config()
+        self.interval = interval or cfg['prune_interval']
+        self.batch = batch or cfg['prune_batch']
+        self.pause = cfg['prune_pause'] / 1000
+        self.retention = cfg['retention']
+        self.rollupretention = cfg['rollup_retention']
+
+    def _prune(self, table, condition):
+        """
+        Delete the rows matching a condition in batches, returns the number of deleted rows
+        """
+        deleted = 0
+        while not self.shutdown.is_set():
+            ids = [id for id, in table.select(table.id).where(condition).limit(self.batch).tuples()]
+            if not ids:
+                break
+            deleted += table.delete().where(table.id << ids).execute()
+            self.shutdown.wait(self.pause)
+        return deleted
+
+    @staticmethod
+    def _cutoff(days):
+        return datetime.datetime.now() - datetime.timedelta(days=days)
+
+    def _drop(self, model, retentions):
+        """
+        Drop the partitions of a value table older than the longest retention,
+        nothing is dropped when any of the retentions is unlimited
+        """
+        days = [retention or self.retention for retention in retentions]
+        if model.partitions is None or not days or not all(days):
+            return
+        for name in model.partitions.drop(self._cutoff(max(days))):
+            self.logger.info("Dropped partition {}".format(name))
+
+    def prune(self):
+        """
+        Create the upcoming partitions and delete all values older than their retention
+        """
+        deleted = 0
+        for model in (SensorValue, TriggerValue):
+            if model.partitions is not None:
+                model.partitions.upcoming()
+        sensors = list(Sensor.select(Sensor.id, Sensor.retention, Sensor.rollupretention).tuples())
+        self._drop(SensorValue, [retention for sensor, retention, rollupretention in sensors])
+        for sensor, retention, rollupretention in sensors:
+            retention = retention or self.retention
+            if retention:
+                cutoff = self._cutoff(retention)
+                for table in SensorValue.tables(end=cutoff):
+                    deleted += self._prune(table, (table.sensor == sensor) & (table.timestamp < cutoff))
+                if SensorValue.store is not None:
+                    deleted += SensorValue.store.drop(sensor, cutoff)
+            rollupretention = rollupretention or self.rollupretention
+            if rollupretention:
+                for table in rolluptables:
+                    deleted += self._prune(table, (table.sensor == sensor) &
+                                           (table.timestamp < self._cutoff(rollupretention)))
+        triggers = list(Trigger.select(Trigger.id, Trigger.retention).where(Trigger.record == True).tuples())
+        self._drop(TriggerValue, [retention for trigger, retention in triggers])
+        for trigger, retention in triggers:
+            retention = retention or self.retention
+            if retention:
+                cutoff = self._cutoff(retention)
+                for table in TriggerValue.tables(end=cutoff):
+                    deleted += self._prune(table, (table.trigger == trigger) & (table.timestamp < cutoff))
+        return deleted
+
+    def run(self):
+        self.db = dbhandler()
+        self.db.connect()
+        while not self.shutdown.is_set():
+            try:
+                deleted = self.prune()
+            except peewee.DatabaseError as err:
+                self.logger.error("Pruning values failed: {}".format(err))
+            else:
+                self.logger.debug("Pruned {} values".format(deleted))
+            self.shutdown.wait(self.interval)
+        self.db.close()
+
+    def end(self):
+        """
+        Stop the pruner
+        """
+        self.shutdown.set()
+
+
+class triggerindex:
+    """In memory index of the sensor to trigger and trigger to trigger
+    dependencies. Replaces the :class:`Trigger` affected queries on the hot path.
+    """
+
+    def __init__(self):
+        self.triggers = {}
+        self.bysensor = {}
+        self.bytrigger = {}
+        self.sources = {}
+
+    def build(self):
+        """Build the index from the :class:`VarSensor` and :class:`VarTrigger` tables
+        """
+        self.triggers = {}
+        self.bysensor = {}
+        self.bytrigger = {}
+        self.sources = {}
+        byexpression = {}
+        for trigger in Trigger.select(Trigger, Expression).join(Expression):
+            self.triggers[trigger.id] = trigger
+            self.sources[trigger.id] = (set(), set())
+            byexpression.setdefault(trigger.expression.id, []).append(trigger.id)
+        varsensors = VarSensor.select(VarSensor.source, VarSensor.expression).tuples()
+        for source, expression in varsensors:
+            for trigger in byexpression.get(expression, []):
+                self._link(trigger, sensor=source)
+        vartriggers = VarTrigger.select(VarTrigger.source, VarTrigger.expression).tuples()
+        for source, expression in vartriggers:
+            for trigger in byexpression.get(expression, []):
+                self._link(trigger, source=source)
+
+    def _link(self, trigger, sensor=None, source=None):
+        sensors, triggers = self.sources[trigger]
+        if sensor is not None:
+            sensors.add(sensor)
+            self.bysensor.setdefault(sensor, set()).add(trigger)
+        if source is not None and source != trigger:
+            triggers.add(source)
+            self.bytrigger.setdefault(source, set()).add(trigger)
+
+    def add_trigger(self, trigger):
+        """Add a trigger to the index, an already indexed trigger is replaced.
+        Raises a :class:`cycleerror` if the trigger would depend on itself, the
+        trigger is then removed from the index.
+
+        :param trigger: The :class:`Trigger` to add
+        """
+        self.remove_trigger(trigger.id)
+        varsensors = VarSensor.select(VarSensor.source).where(VarSensor.expression == trigger.expression).tuples()
+        vartriggers = VarTrigger.select(VarTrigger.source).where(VarTrigger.expression == trigger.expression).tuples()
+        sources = {source for source, in vartriggers}
+        if self.would_cycle(trigger.id, sources):
+            raise cycleerror(trigger, "Trigger {} would depend on itself".format(trigger.id))
+        self.triggers[trigger.id] = trigger
+        self.sources[trigger.id] = (set(), set())
+        for source, in varsensors:
+            self._link(trigger.id, sensor=source)
+        for source in sources:
+            self._link(trigger.id, source=source)
+
+    def would_cycle(self, trigger, sources):
+        """Check if a trigger depending on the sources would create a dependency cycle
+
+        :param trigger: ID of the :class:`Trigger`
+        :param sources: IDs of the triggers the trigger depends on
+        :rtype: True if the trigger would depend on itself
+        """
+        trigger = int(trigger)
+        seen = set()
+        stack = [trigger]
+        while stack:
+            current = stack.pop()
+            for affected in self.bytrigger.get(current, ()):
+                if affected not in seen:
+                    seen.add(affected)
+                    stack.append(affected)
+        return bool(seen & {int(source) for source in sources if int(source) != trigger})
+
+    def cascade(self, sensor=None, trigger=None):
+        """Returns all :class:`Trigger` depending directly or indirectly on a sensor
+        or trigger, ordered so that every trigger comes after its source triggers.
+
+        :param sensor: ID of the changed :class:`Sensor`
+        :param trigger: ID of the changed :class:`Trigger`
+        :rtype: a list of :class:`Trigger`
+        """
+        if sensor is not None:
+            stack = list(self.bysensor.get(int(sensor), ()))
+        else:
+            stack = list(self.bytrigger.get(int(trigger), ()))
+        affected = set(stack)
+        while stack:
+            for dependent in self.bytrigger.get(stack.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+        indegree = {current: len(self.sources[current][1] & affected) for current in affected}
+        ready = [current for current, degree in indegree.items() if degree == 0]
+        order = []
+        while ready:
+            current = ready.pop()
+            order.append(self.triggers[current])
+            for dependent in self.bytrigger.get(current, ()):
+                if dependent in indegree:
+                    indegree[dependent] -= 1
+                    if indegree[dependent] == 0:
+                        ready.append(dependent)
+        if len(order) != len(affected):
+            raise cycleerror(None, "Dependency cycle between triggers {}".format(
+                sorted(set(affected) - {current.id for current in order})))
+        return order
+
+    def remove_trigger(self, trigger):
+        """Remove a trigger from the index
+
+        :param trigger: ID of the :class:`Trigger` to remove
+        """
+        trigger = int(trigger)
+        self.triggers.pop(trigger, None)
+        sensors, triggers = self.sources.pop(trigger, (set(), set()))
+        for sensor in sensors:
+            self.bysensor[sensor].discard(trigger)
+        for source in triggers:
+            self.bytrigger[source].discard(trigger)
+
+    def affected_by_sensor(self, sensor):
+        """Returns all :class:`Trigger` affected by the specified sensor
+
+        :param sensor: ID of the :class:`Sensor`
+        """
+        return [self.triggers[trigger] for trigger in self.bysensor.get(int(sensor), ())]
+
+    def affected_by_trigger(self, trigger):
+        """Returns all :class:`Trigger` affected by the specified trigger
+
+        :param trigger: ID of the :class:`Trigger`
+        """
+        return [self.triggers[affected] for affected in self.bytrigger.get(int(trigger), ())]
+
 
 class actionhandler(threading.Thread):
     """Action handler thread. Separate thread for handling and activating actions.
+    Actions are handed to a pool of dispatch workers through a lane per module
+    queue, the actions of a module are called in order and at most one at a time.
     """
 
-    def __init__(self, rpc, queue=None, loghandler=None, loglevel=None):
+    def __init__(self, rpc, queue=None, loghandler=None, loglevel=None, rpcfactory=None, workers=None, inflight=None):
+        """
+         - rpc: rpc object to call the actions with
+         - rpcfactory: function returning a new rpc object for a worker, called with
+         the number of the worker. gives every worker its own connection, the workers
+         share rpc if none given
+         - workers: number of dispatch workers
+         - inflight: maximum number of pending actions per module, further actions are dropped
+        """
         threading.Thread.__init__(self)
         self.shutdown = False
         self.logger = logging.getLogger('Action')
@@ -144,6 +935,13 @@ class actionhandler(threading.Thread):
             self.logger.addHandler(loghandler)
         self.logger.debug("Initializing action checker thread")
         self.rpc = rpc
+        self.rpcfactory = rpcfactory
+        cfg = domosSettings.get_core_config()
+        self.inflight = inflight or cfg['action_inflight']
+        self.templates = {}
+        self.lanes = {}
+        self.ready = qu.Queue()
+        self.lock = threading.Lock()
         if not queue:
             self.q = qu.Queue()
         else:
@@ -153,44 +951,192 @@ class actionhandler(threading.Thread):
             self.db.connect()
             self.calculator = matchcalculator(self.db, GRAMMAR)
         except:
-            self.logger.crit("Could not connect to database, shutting down")
+            self.logger.critical("Could not connect to database, shutting down")
             self.shutdown = True
+        self.workers = [actionworker(self, number) for number in range(workers or cfg['action_workers'])]
 
     def getqueue(self):
         return self.q
 
+    def action_changed(self, action=None):
+        """
+        Drop the argument template of a changed action, all templates if none is given
+         - action: ID of the changed action
+        """
+        self.q.put(("actionchanged", action, None))
+
+    def template(self, action, calculator):
+        """
+        Returns the argument template of an action, the template is built on first use
+        """
+        template = self.templates.get(action.id)
+        if template is None:
+            template = actiontemplate(action, calculator)
+            self.templates[action.id] = template
+        return template
+
+    def _dispatch(self, triggeraction, item):
+        """
+        Hand a triggered action to the lane of its module
+        """
+        queue = triggeraction.action.modulerpc.module.queue
+        lane = self.lanes.get(queue)
+        if lane is None:
+            lane = actionlane(queue, self.inflight)
+            self.lanes[queue] = lane
+        try:
+            lane.items.put_nowait((triggeraction, item))
+        except qu.Full:
+            self.logger.error("Too many pending actions for module queue {}, dropping action {}".format(
+                queue, triggeraction.action.name))
+            return
+        with self.lock:
+            if not lane.scheduled:
+                lane.scheduled = True
+                self.ready.put(lane)
+
+    def done(self, lane):
+        """
+        Called by a worker after handling an item of a lane, schedules the lane again if it has pending actions
+        """
+        with self.lock:
+            if lane.items.empty():
+                lane.scheduled = False
+            else:
+                self.ready.put(lane)
+
+    def processitem(self, item):
+        # get all actions attached
+        type, trigger, value = item
+        if type == "actionchanged":
+            if trigger is None:
+                self.templates = {}
+            else:
+                self.templates.pop(int(trigger), None)
+            return
+        for triggeraction in TriggerAction.get_by_trigger(trigger):
+            self._dispatch(triggeraction, item)
+
+    def run(self):
+        for worker in self.workers:
+            worker.start()
+        while not self.shutdown:
+            try:
+                item = self.q.get(timeout=2)
+                self.processitem(item)
+            except qu.Empty:
+                pass
+        for worker in self.workers:
+            worker.shutdown = True
+        for worker in self.workers:
+            worker.join()
+
+    def end(self):
+        """
+        Stop the action handler and its workers
+        """
+        self.shutdown = True
+
+
+class actionlane:
+    """Pending actions of a module queue
+    """
+
+    def __init__(self, queue, maxsize):
+        self.queue = queue
+        self.items = qu.Queue(maxsize)
+        self.scheduled = False
+
+
+class actionworker(threading.Thread):
+    """Dispatch worker of the action handler. Takes a lane, checks the condition
+    of its next action and calls it, then hands the lane back.
+    """
+
+    def __init__(self, handler, number=0):
+        """
+         - handler: the actionhandler the worker belongs to
+         - number: number of the worker
+        """
+        threading.Thread.__init__(self)
+        self.shutdown = False
+        self.handler = handler
+        self.number = number
+        self.logger = handler.logger
+
     def _callaction(self, action):
-        args = ActionArg.get_dict(action, self.calculator)
+        args = self.handler.template(action, self.calculator).render(self.calculator)
         pprint(args)
         module = action.modulerpc.module
         self.rpc.fire(module.queue,
                       action.modulerpc.key,
                       **args)
 
-    def processitem(self, item):
-        # get all actions attached
-        type, trigger, value = item
-        actions = TriggerAction.get_by_trigger(trigger)
-        #self.logger.debug("Found action with trigger".format(len(actions)))
-        for action in actions:
-            #check if action is activated
-            active = self.calculator.resolve(action.expression, item)
-            #TODO: supply variables for transform
-            try:
-                active = float(active)
-            except:
-                self.logger.debug("Parsing action activation condition as string")
-            if active:
-                self.logger.info("Calling action {}".format(action.action.name))
-                self._callaction(action.action)
+    def processitem(self, triggeraction, item):
+        #check if action is activated
+        active = self.calculator.resolve(triggeraction.expression, item)
+        #TODO: supply variables for transform
+        try:
+            active = float(active)
+        except:
+            self.logger.debug("Parsing action activation condition as string")
+        if active:
+            self.logger.info("Calling action {}".format(triggeraction.action.name))
+            self._callaction(triggeraction.action)
 
     def run(self):
+        if self.handler.rpcfactory:
+            self.rpc = self.handler.rpcfactory(self.number)
+        else:
+            self.rpc = self.handler.rpc
+        self.db = dbhandler()
+        self.db.connect()
+        self.calculator = matchcalculator(self.db, GRAMMAR)
         while not self.shutdown:
             try:
-                item = self.q.get(timeout=2)
-                self.processitem(item)
+                lane = self.handler.ready.get(timeout=2)
+            except qu.Empty:
+                continue
+            try:
+                self.processitem(*lane.items.get_nowait())
             except qu.Empty:
                 pass
+            except Exception as err:
+                self.logger.error("Calling an action for module queue {} failed: {}".format(lane.queue, err))
+            finally:
+                self.handler.done(lane)
+        self.db.close()
+
+
+class actiontemplate:
+    """Precompiled arguments of an action. Constant arguments are resolved
+    once, arguments using sensors or triggers are resolved when the action is called.
+    """
+
+    def __init__(self, action, calculator):
+        """
+         - action: the :class:`Action` to build the template for
+         - calculator: matchcalculator to compile and resolve the argument expressions with
+        """
+        self.constant = {}
+        self.variable = []
+        for arg in ActionArg.get_by_action(action):
+            compiled = calculator.compile(arg.value)
+            if compiled.sensors or compiled.triggers:
+                self.variable.append((arg.rpcarg.name, arg.value))
+            else:
+                key, value = ActionArg._to_dict(self.constant, arg.rpcarg.name, compiled({}, {}))
+                self.constant[key] = value
+
+    def render(self, calculator):
+        """
+        Returns the argument dict of the action
+        """
+        kwargs = copy.deepcopy(self.constant)
+        for name, expression in self.variable:
+            key, value = ActionArg._to_dict(kwargs, name, calculator.resolve(expression))
+            kwargs[key] = value
+        return kwargs
 
 
 class matchcalculator:
@@ -198,6 +1144,9 @@ class matchcalculator:
     Class to resolve expression objects from the database. resolves a expression record to a value.
     '''
     grammarobj = None
+    compiled = {}
+    # the parser is shared by the threads using a calculator
+    lock = threading.Lock()
 
     def __init__(self, database, grammar=None):
         '''
@@ -209,51 +1158,233 @@ class matchcalculator:
         if (not matchcalculator.grammarobj) and grammar:
             matchcalculator.grammarobj = Grammar(GRAMMAR)
 
+    @staticmethod
+    def _number(value):
+        """
+        Returns a text value as a number if it is one, text sensors store their values as text
+        """
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        return value
+
+    @staticmethod
+    def _current(func):
+        # instant sensors keep no values, all their functions use the value that was sent
+        return func.source.instant or (func.function == 'last' and int(func.args) <= 1)
+
     def _fetchvars(self, expression, updateditem=None):
+        updated = None
         if updateditem:
             type, id, value = updateditem
+            if type == 'sensor':
+                updated = int(id)
         sensorfuncs = expression.get_used_sensors()
         sensorvars = {}
         for func in sensorfuncs:
-            if updateditem and (func.source.id == id):
-                str(value)
-                try:
-                    value = float(value)
-                except:
-                    pass
-                sensorvars[str(func.id)] = value
+            if func._data['source'] == updated and self._current(func):
+                sensorvars[str(func.id)] = self._number(value)
             else:
-                dictval = ops.operation(func)
-                try:
-                    dictval = float(dictval)
-                except:
-                    pass
-                sensorvars[str(func.id)] = dictval
+                sensorvars[str(func.id)] = self._number(ops.operation(func))
         triggerfuncs = [func for func in expression.get_used_triggers()]
         # TODO: add function dict
-
-        def _convtriggervar(func):
-            value = ops.operation(func)
-            try:
-                value = float(value)
-            except:
-                pass
-            return value
-
-        triggervars = {str(func.id):
-                           _convtriggervar(func)
+        triggervars = {str(func.id): self._number(ops.operation(func))
                        for func in triggerfuncs}
         return (sensorvars, triggervars)
 
+    def compile(self, expression):
+        '''
+        returns the compiled form of an expression database object. Compiled
+        expressions are cached by expression id and built from the syntax tree
+        stored in the pickled column of the expression, the expression is only
+        parsed again when the expression string changed.
+         - expression: the expression object to compile
+        '''
+        compiled = matchcalculator.compiled.get(expression.id)
+        if compiled and compiled.expression == expression.expression:
+            return compiled
+        compiled = None
+        if expression.pickled:
+            compiled = compiledexpression.loads(expression.pickled)
+            if compiled and compiled.expression != expression.expression:
+                compiled = None
+        if not compiled:
+            compiled = Compiler().compile(expressions.parse(expression.expression), expression.expression)
+            expression.pickled = compiled.dumps()
+            Expression.update(pickled=expression.pickled).where(Expression.id == expression.id).execute()
+        matchcalculator.compiled[expression.id] = compiled
+        return compiled
+
+    def preload(self):
+        '''
+        loads the compiled form of all expressions in a single query and
+        compiles the expressions without a usable stored form.
+        returns the number of expressions that had to be compiled.
+        '''
+        missing = []
+        for expression in Expression.select().iterator():
+            compiled = None
+            if expression.pickled:
+                compiled = compiledexpression.loads(expression.pickled)
+            if compiled and compiled.expression == expression.expression:
+                matchcalculator.compiled[expression.id] = compiled
+            else:
+                missing.append(expression)
+        for expression in missing:
+            self.compile(expression)
+        return len(missing)
+
     def resolve(self, expression, updateditem=None):
         '''
         resolves a match database object to a value.
          - match: the match object to resolve
          - updateditem: the sensor that triggered the trigger. needed when the sensor is a oneshot sensor.
         '''
+        compiled = self.compile(expression)
+        if not (compiled.sensors or compiled.triggers):
+            # constant expression, no variables to fetch
+            return compiled({}, {})
         sensvars, trigvars = self._fetchvars(expression, updateditem)
-        tree = self.grammarobj.parse(expression.expression)
-        return Calc().transform(tree, sensvars, trigvars)
+        return compiled(sensvars, trigvars)
+
+
+class compiledexpression:
+    '''
+    Compiled expression, a python code object build from the syntax tree of an
+    expression. The syntax tree is stored in the database, the code is compiled
+    again when it is loaded.
+    '''
+
+    def __init__(self, expression, tree, code, sensors=(), triggers=()):
+        '''
+         - expression: the expression string the code is compiled from
+         - tree: the syntax tree of the expression, see :func:`domos.util.expression.parse`
+         - code: the python code object
+         - sensors: the sensor ids used by the expression
+         - triggers: the trigger ids used by the expression
+        '''
+        self.expression = expression
+        self.tree = tree
+        self.code = code
+        self.sensors = tuple(sensors)
+        self.triggers = tuple(triggers)
+
+    def __call__(self, sensvars=None, trigvars=None):
+        variables = {'s': sensvars or {}, 't': trigvars or {}}
+        return str(float(eval(self.code, Compiler.namespace, variables)))
+
+    def dumps(self):
+        '''
+        returns the serialized syntax tree of the compiled expression
+        '''
+        return expressions.dumps(self.expression, self.tree)
+
+    @classmethod
+    def loads(cls, data):
+        '''
+        returns a compiled expression from a serialized syntax tree, or None when
+        the data is not a valid syntax tree.
+        '''
+        stored = expressions.loads(data)
+        if stored is None:
+            return None
+        expression, tree = stored
+        try:
+            return Compiler().compile(tree, expression)
+        except (ValueError, TypeError, IndexError):
+            return None
+
+
+class Compiler:
+    '''
+    Compiles the syntax trees of :func:`domos.util.expression.parse` into python code.
+    Only the nodes and tokens of the grammar are accepted, so a stored syntax tree can
+    not inject code. Evaluating the code gives the same result as the :class:`Calc` transformer.
+    '''
+    namespace = {'__builtins__': {'float': float},
+                 '_or': lambda arg1, arg2: float(op.truth(arg1) or op.truth(arg2)),
+                 '_and': lambda arg1, arg2: float(op.truth(arg1) and op.truth(arg2))}
+    operators = {'add': ('add_symbol', {'+', '-'}),
+                 'mul': ('mul_symbol', {'*', '/', '//', '%'}),
+                 'exp': ('exp_symbol', {'**'}),
+                 'eql': ('eql_symbol', {'==', '<=', '!=', '>=', '<', '>'}),
+                 'lgc': ('lgc_symbol', {'||', '&&'})}
+    tokens = {'number': re.compile(r'[\d.]+'),
+              'string': re.compile(r'"\w+"'),
+              'sensor': re.compile(r'__sens(\d+)__'),
+              'trigger': re.compile(r'__trig(\d+)__'),
+              'macro': re.compile(r'__macr(\d+)__')}
+
+    def compile(self, tree, expression):
+        '''
+        returns the compiled expression of a syntax tree, raises ValueError
+        if the tree contains anything the grammar does not produce.
+         - tree: the syntax tree
+         - expression: the expression string of the tree
+        '''
+        self.sensors = set()
+        self.triggers = set()
+        code = compile(self._source(tree), '<expression>', 'eval')
+        return compiledexpression(expression, tree, code, sorted(self.sensors), sorted(self.triggers))
+
+    def _token(self, node, head):
+        if not (isinstance(node, list) and len(node) == 2 and node[0] == head and isinstance(node[1], str)):
+            raise ValueError('Expected a {} token, got {!r}'.format(head, node))
+        token = node[1]
+        if head in self.tokens:
+            match = self.tokens[head].fullmatch(token)
+            if not match:
+                raise ValueError('Invalid {} token {!r}'.format(head, token))
+            return match.group(match.lastindex or 0)
+        return token
+
+    def _source(self, node):
+        if not (isinstance(node, list) and node and isinstance(node[0], str)):
+            raise ValueError('Invalid syntax tree node {!r}'.format(node))
+        head, tail = node[0], node[1:]
+        if head in self.operators:
+            symbol, allowed = self.operators[head]
+            arg1, operator_symbol, arg2 = tail
+            operator_symbol = self._token(operator_symbol, symbol)
+            if operator_symbol not in allowed:
+                raise ValueError('Invalid operator {!r}'.format(operator_symbol))
+            arg1, arg2 = self._source(arg1), self._source(arg2)
+            if operator_symbol == '||':
+                return '_or({}, {})'.format(arg1, arg2)
+            elif operator_symbol == '&&':
+                return '_and({}, {})'.format(arg1, arg2)
+            return '({} {} {})'.format(arg1, operator_symbol, arg2)
+        elif head == 'start':
+            child, = tail
+            return self._source(child)
+        elif head == 'parenthesis':
+            popen, child, pclose = tail
+            return '({})'.format(self._source(child))
+        elif head == 'neg':
+            child, = tail
+            return '(-{})'.format(self._source(child))
+        elif head == 'number':
+            return repr(float(self._token(node, head)))
+        elif head == 'true_symbol':
+            return repr(float(1))
+        elif head == 'false_symbol':
+            return repr(float(0))
+        elif head == 'string':
+            return repr(self._token(node, head)[1:-1])
+        elif head == 'sensor':
+            sensorid = self._token(node, head)
+            self.sensors.add(sensorid)
+            return 's.get({!r}, 0)'.format(sensorid)
+        elif head == 'trigger':
+            triggerid = self._token(node, head)
+            self.triggers.add(triggerid)
+            return 't.get({!r}, 0)'.format(triggerid)
+        elif head == 'macro':
+            self._token(node, head)
+            return '4'  # random dice roll
+        raise ValueError('Unknown syntax tree node {!r}'.format(head))
 
 
 class Calc(STransformer):
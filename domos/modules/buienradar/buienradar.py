@@ -1,5 +1,5 @@
 import urllib.request
-from domos.util.rpc import rpc
+from domos.util.rpc import rpc, sensorbatch
 from domos.util.domoslog import rpchandler
 import logging
 import multiprocessing
@@ -49,6 +49,7 @@ class BuienRadar(multiprocessing.Process):
 
     def _init_rpc(self):
         self.rpc = rpc(self.name)
+        self.values = sensorbatch(self.rpc)
 
         self.logger = logging.getLogger('BuienRadar')
         loghandler = rpchandler(self.rpc)
@@ -87,7 +88,8 @@ class BuienRadar(multiprocessing.Process):
                     rain_level, time_measure = line.split('|')
                     future_rain[time_measure] = int(rain_level)
             value = rain.func(future_rain, rain)
-            self.rpc.fire("domoscore", "sensorValue", key=rain.key, value=value)
+            self.values.put(rain.key, value)
+        self.values.flush()
 
     @staticmethod
     def _calc_rain_mm(level):
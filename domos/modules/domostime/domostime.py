@@ -2,9 +2,8 @@
 
 from threading import Thread
 import domos.util.domossettings as ds
-from domos.util.rpc import rpc
+from domos.util.rpc import rpc, sensorbatch
 from domos.util.domoslog import rpchandler
-from dashi import DashiConnection
 import socket
 import logging
 from multiprocessing import Process
@@ -78,6 +77,7 @@ class DomosTime(Process):
 
     def initrpc(self):
         self.rpc = rpc(self.name)
+        self.values = sensorbatch(self.rpc)
         self.logger = logging.getLogger('DomosTime')
         self.logger.setLevel(logging.DEBUG)
         loghandler = rpchandler(self.rpc)
@@ -131,13 +131,13 @@ class DomosTime(Process):
         return returnvalue
 
     def _job_true(self, key, name):
-        self.rpc.fire("domoscore", 'sensorValue', key=key, value='1')
+        self.values.put(key, '1')
 
     def _job_false(self, key, name):
-        self.rpc.fire("domoscore", 'sensorValue', key=key, value='0')
+        self.values.put(key, '0')
 
     def _job_once(self, key, name):
-        self.rpc.fire("domoscore", 'sensorValue', key=key, value='1')
+        self.values.put(key, '1')
 
     def get_jobs(self):
         self.logger.debug("All jobs requested")
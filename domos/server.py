@@ -1,11 +1,13 @@
 import os
 import importlib
+import signal
 
 import importlib.machinery
 import domos.util.domoslog as domoslog
 from domos.util.rpc import rpc
 from domos.handlers import *
 from domos.util.db import *
+from domos.util.ringbuffer import bufferstore
 from collections import namedtuple
 
 class MessageHandler(threading.Thread):
@@ -19,7 +21,11 @@ class MessageHandler(threading.Thread):
         self.rpc.log_info("starting main thread")
         self.rpc.handle(self.register, "register")
         self.rpc.handle(self.sensorValue, "sensorValue")
+        self.rpc.handle(self.sensorValues, "sensorValues")
         self.rpc.handle(self.add_sensor, "add_sensor")
+        self.rpc.handle(self.sensorChanged, "sensorChanged")
+        self.rpc.handle(self.actionChanged, "actionChanged")
+        self.rpc.handle(self.triggerChanged, "triggerChanged")
         rpchandle = domoslog.rpchandler(self.rpc)
         self.logger = logging.getLogger('Core')
         self.logger.addHandler(rpchandle)
@@ -37,10 +43,31 @@ class MessageHandler(threading.Thread):
             self.db.create_tables()
             self.db.init_tables()
             self.logger.info("Done initializing database")
-            self.triggerchecker = TriggerChecker(loghandler=rpchandle)
+            calculator = matchcalculator(self.db, grammar=GRAMMAR)
+            compiled = calculator.preload()
+            self.logger.info("Loaded expressions, {} expressions compiled".format(compiled))
+            sensorCache.load()
+            self.buffers = bufferstore()
+            self.buffers.warm()
+            ops.buffers = self.buffers
+            self.writer = valueWriter(loghandler=rpchandle)
+            SensorValue.writer = self.writer
+            self.writer.start()
+            self.rollup = rollupHandler(loghandler=rpchandle)
+            self.rollup.start()
+            self.pruner = pruneHandler(loghandler=rpchandle)
+            self.pruner.start()
+            self.triggerstate = triggerState(loghandler=rpchandle)
+            self.triggerstate.load()
+            Trigger.state = self.triggerstate
+            self.triggerstate.start()
+            queue = coalescingQueue(sensors=[sensor.id for sensor in sensorCache.sensors.values() if sensor.coalesce])
+            self.triggerchecker = triggerChecker(queue=queue, loghandler=rpchandle)
             self.triggerqueue = self.triggerchecker.getqueue()
             self.triggerchecker.start()
-            self.actionhandler = actionhandler(self.rpc, loghandler=rpchandle)
+            # the workers send with their own connections, named apart from the queue of the core
+            self.actionhandler = actionhandler(self.rpc, loghandler=rpchandle,
+                                               rpcfactory=lambda number: rpc('{}-action{}'.format(self.name, number)))
             self.actionqueue = self.actionhandler.getqueue()
             self.triggerchecker.setactionqueue(self.actionqueue)
             self.actionhandler.start()
@@ -70,12 +97,13 @@ class MessageHandler(threading.Thread):
                 ModuleRPC.add(module, rpc['key'], rpc['type'], argslist)
         else:
             self.logger.debug("Sending sensors to module")
-            sensors = Sensor.get_by_module(module)
+            sensors = list(Sensor.get_by_module(module))
             module.active = True
             module.save()
             sensorlist = []
+            sensordicts = SensorArg.get_dicts(sensors)
             for sensor in sensors:
-                sensordict = SensorArg.get_dict(sensor)
+                sensordict = sensordicts[sensor.id]
                 sensordict['rpc'] = sensor.modulerpc.key
                 sensorlist.append(sensordict)
             return sensorlist
@@ -85,10 +113,60 @@ class MessageHandler(threading.Thread):
         self.logger.info('adding sensor from module {0} with ident {1}'.format(module_id, data['ident']))
         module = Module.get_by_id(module_id)
         sensor = Sensor.add(module, data['ident'], data)
+        sensorCache.invalidate(sensor.id)
         self.logger.info('Sensor added')
         if send:
             self.sendSensor(module, sensor)
 
+    def sensorChanged(self, key=None):
+        """RPC function to notify the core of a changed or removed sensor
+
+        :param key: key of the sensor, also the primary key of the sensor in the database,
+                    all sensors are reloaded if not given
+        """
+        if key is None:
+            sensorCache.load()
+            coalesced = {sensor.id for sensor in sensorCache.sensors.values() if sensor.coalesce}
+            for sensor in coalesced | set(self.triggerqueue.sensors):
+                self.triggerqueue.set_coalesce(sensor, sensor in coalesced)
+            return
+        sensorCache.invalidate(key)
+        try:
+            sensor = sensorCache.get(key)
+        except DoesNotExist:
+            self.triggerqueue.set_coalesce(key, False)
+        else:
+            self.triggerqueue.set_coalesce(key, sensor.coalesce)
+
+    def triggerChanged(self, key=None):
+        """RPC function to notify the core of an added, changed or removed trigger. Also call it when
+        the expression of a trigger or the sensors and triggers used in the expression changed
+
+        :param key: key of the trigger, all triggers are reloaded if not given
+        :rtype: False if the trigger is rejected because it would depend on itself
+        """
+        if key is None:
+            self.triggerchecker.triggers_reloaded()
+            return True
+        try:
+            trigger = Trigger.get_by_id(key)
+        except DoesNotExist:
+            self.triggerchecker.trigger_removed(key)
+            return True
+        if trigger.depends_on(trigger):
+            self.logger.error('Rejected trigger {0}, it would depend on itself'.format(key))
+            self.triggerchecker.trigger_removed(key)
+            return False
+        self.triggerchecker.trigger_added(key)
+        return True
+
+    def actionChanged(self, key=None):
+        """RPC function to notify the core of a changed or removed action or action argument
+
+        :param key: key of the action, all actions if not given
+        """
+        self.actionhandler.action_changed(key)
+
     def sendSensor(self, module, sensor):
         rpccall = ModuleRPC.get_by_module(module, 'add')[0]
         self.rpc.call(module.queue,
@@ -100,18 +178,64 @@ class MessageHandler(threading.Thread):
 
         :param key: key of the sensor, also the primary key of the sensor in the database
         :param value: new value to send to the database
-        :param timestamp: Timestamp of the value, leave empty to set it as the current time
+        :param timestamp: Timestamp of the value in seconds since the epoch or as an ISO 8601 string,
+                          leave empty to set it as the current time
+        """
+        self._addvalue(key, value, timestamp)
+
+    def sensorValues(self, values=None):
+        """RPC function to send a batch of data values to the core in a single message
+
+        :param values: list of [key, value, timestamp] lists, see :meth:`sensorValue`
         """
+        for item in values or []:
+            try:
+                key, value, timestamp = item
+            except (TypeError, ValueError):
+                self.logger.warn('Dropping malformed sensor value {0}'.format(item))
+                continue
+            self._addvalue(key, value, timestamp)
+
+    @staticmethod
+    def _timestamp(timestamp):
+        """Returns the datetime of a timestamp sent by a module, the current time if it is empty
+        """
+        if timestamp is None or timestamp == '':
+            return datetime.datetime.now()
+        if isinstance(timestamp, str):
+            try:
+                timestamp = float(timestamp)
+            except ValueError:
+                timestamp = datetime.datetime.fromisoformat(timestamp)
+                if timestamp.tzinfo is not None:
+                    timestamp = timestamp.astimezone().replace(tzinfo=None)
+                return timestamp
+        return datetime.datetime.fromtimestamp(timestamp)
 
+    def _addvalue(self, key, value, timestamp):
         try:
             self.logger.debug('logging trigger value for {0} with value {1}'.format(key, value))
-            Sensor.get_by_id(key).add_value(value)
+            sensor = sensorCache.get(key)
+            if not sensor.active:
+                self.logger.debug('dropping value for inactive sensor {0}'.format(key))
+                return
+            if sensor.numeric:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    self.logger.warn('Storing non numeric value {1} of sensor {0} as text'.format(key, value))
+            timestamp = self._timestamp(timestamp)
+            self.writer.put(sensor.id, value, timestamp)
+            if not sensor.instant:
+                self.buffers.append(sensor.id, value, timestamp)
+            if isinstance(value, float):
+                self.rollup.put(sensor.id, value, timestamp)
         except Exception as e:
             self.logger.warn('Something went wrong registering trigger value for {0}: {1}'.format(key, e))
         else:
             # lauch trigger checks
             self.logger.debug('posting sensordata to trigger processor')
-            self.triggerqueue.put(("sensor", key, value))
+            self.triggerqueue.put(("sensor", sensor.id, value))
 
     def run(self):
         """Start the core thread
@@ -119,9 +243,20 @@ class MessageHandler(threading.Thread):
         self.logger.info("starting Dashi consumer")
         while not self.shutdown:
             self.rpc.listen()
+        # the trigger checker sets trigger values until it stops, the trigger state writes them last
+        self.triggerchecker.end()
+        self.triggerchecker.join()
+        self.apihandler.end()
+        self.actionhandler.end()
+        self.writer.end()
+        self.rollup.end()
+        self.pruner.end()
+        self.triggerstate.end()
+        for thread in (self.apihandler, self.actionhandler, self.writer, self.rollup, self.pruner, self.triggerstate):
+            thread.join()
 
     def end(self):
-        """Stop the core thread
+        """Stop the core thread, buffered sensor values are written before the thread ends
         """
         self.shutdown = True
 
@@ -143,6 +278,7 @@ class apihandler(threading.Thread):
         self.rpc.handle(self.listSensors, "getSensors")
         self.rpc.handle(self.listSensorArgs, "getArgs")
         self.rpc.handle(self.listPrototypes, "getProtos")
+        self.rpc.handle(self.getHistory, "getHistory")
         self.db = dbhandler()
 
     def listModules(self):
@@ -209,6 +345,29 @@ class apihandler(threading.Thread):
                                        arg.descr) for arg in rpc.args]) for rpc in rpcs]
         return returnvalue
 
+    def getHistory(self, sensor=None, start=None, end=None, points=100):
+        """RPC api call, returns the values of a sensor in a time range as a
+        list of tuples (timestamp, min, max, avg, count, last). The
+        resolution is chosen by :meth:`Sensor.history`
+
+        :param sensor: ID of the sensor
+        :param start: Start of the time range in seconds since the epoch, a day before end if omitted
+        :param end: End of the time range in seconds since the epoch, now if omitted
+        :param points: Number of points wanted in the time range
+        """
+        try:
+            sensor = Sensor.get_by_id(sensor)
+        except DoesNotExist:
+            return None
+        end = datetime.datetime.fromtimestamp(end) if end else datetime.datetime.now()
+        start = datetime.datetime.fromtimestamp(start) if start else end - datetime.timedelta(days=1)
+        return [(row['timestamp'].timestamp(),
+                 row['min'],
+                 row['max'],
+                 row['avg'],
+                 row['count'],
+                 row['last']) for row in sensor.history(start, end, points)]
+
     def run(self):
         """Start the api handler thread
         """
@@ -216,6 +375,11 @@ class apihandler(threading.Thread):
         while not self.shutdown:
             self.rpc.listen()
 
+    def end(self):
+        """Stop the api handler thread
+        """
+        self.shutdown = True
+
 
 class domos:
 
@@ -258,22 +422,46 @@ class domos:
         #for module in self.modulelist:
         #    self.logger.info(dir(module.loaded_module))
 
+    def migrate(self):
+        """Create missing tables and add missing columns and indexes to an existing database
+        """
+        db = dbhandler(domosSettings.getDBConfig())
+        db.connect()
+        db.create_tables()
+        for change in db.migrate():
+            print(change)
+        db.close()
+
     def main(self):
+        if self.args.migrate:
+            self.migrate()
+            return
         logger = domoslog.rpclogger()
         logger.start()
         msgh = MessageHandler()
         if msgh.shutdown:
             self.logger.log_critical("Initialization error, shutting down", "domoscore")
         else:
+            # stop the core on SIGTERM and SIGINT, buffered values are written before the threads end
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda signum, frame: msgh.end())
             msgh.start()
-            self.rpc = rpc('Main')
-            rpchandle = domoslog.rpchandler(self.rpc)
-            self.logger = logging.getLogger('Main')
-            self.logger.addHandler(rpchandle)
-            self.logger.setLevel(domosSettings.getLoggingLevel('core'))
-            self._module_loader(self.settings['module_dir'])
-            msgh.rpc.log_info('waiting for modules to register')
-            msgh.join()
+            try:
+                self.rpc = rpc('Main')
+                rpchandle = domoslog.rpchandler(self.rpc)
+                self.logger = logging.getLogger('Main')
+                self.logger.addHandler(rpchandle)
+                self.logger.setLevel(domosSettings.getLoggingLevel('core'))
+                self._module_loader(self.settings['module_dir'])
+                msgh.rpc.log_info('waiting for modules to register')
+                while msgh.is_alive():
+                    # a timeout keeps the main thread responsive to signals
+                    msgh.join(1)
+            finally:
+                msgh.end()
+                msgh.join()
+                logger.end()
+                logger.join()
 
 
     @staticmethod
@@ -283,4 +471,6 @@ class domos:
                             help='Verbosity of the server')
         parser.add_argument('--daemon', '-d', action='store_true',
                             help='Verbosity of the server')
+        parser.add_argument('--migrate', action='store_true',
+                            help='Update the tables and indexes of an existing database and exit')
         return parser
\ No newline at end of file
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+from domos.util.rpc import asyncrpc, rpc, rpcerror
+import domos.util.rpc
+import asyncio
+import socket
+import threading
+import unittest
+import uuid
+
+
+class AsyncRPCTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.config = domos.util.rpc.domosSettings.getExchangeConfig
+        domos.util.rpc.domosSettings.getExchangeConfig = staticmethod(lambda: {'transport': 'local'})
+        # queues of the local transport live until the end of the process
+        suffix = uuid.uuid4().hex
+        self.server = asyncrpc('server-' + suffix)
+        self.client = asyncrpc('client-' + suffix)
+
+    def tearDown(self):
+        domos.util.rpc.domosSettings.getExchangeConfig = self.config
+
+    async def asyncSetUp(self):
+        self.server.start()
+        self.client.start()
+
+    async def asyncTearDown(self):
+        self.server.end()
+        self.client.end()
+
+    async def test_call(self):
+        async def double(value=None):
+            await asyncio.sleep(0.01)
+            return value * 2
+        self.server.handle(double, 'double')
+        self.server.handle(lambda value=None: value + 1, 'inc')
+        results = await asyncio.gather(*[self.client.call(self.server.name, 'double', value=num) for num in range(20)])
+        self.assertEqual(results, [num * 2 for num in range(20)])
+        self.assertEqual(await self.client.call(self.server.name, 'inc', value=1), 2)
+
+    async def test_error(self):
+        self.server.handle(lambda: 1 / 0, 'fail')
+        with self.assertRaises(rpcerror):
+            await self.client.call(self.server.name, 'fail')
+
+    async def test_timeout(self):
+        with self.assertRaises(socket.timeout):
+            await self.client.call('nobody-' + self.client.name, 'missing', timeout=0.1)
+        self.assertEqual(self.client.pending, {})
+
+    async def test_fire(self):
+        received = asyncio.Event()
+
+        async def notify():
+            received.set()
+        self.server.handle(notify, 'notify')
+        await self.client.fire(self.server.name, 'notify')
+        await asyncio.wait_for(received.wait(), 2)
+
+    async def test_nested_call(self):
+        # a coroutine handler calling back while a synchronous message is handled
+        self.client.handle(lambda: 'pong', 'ping')
+        results = []
+
+        async def relay():
+            results.append(await self.server.call(self.client.name, 'ping'))
+        self.server.handle(relay, 'relay')
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.server.transport.fire(self.server.name, 'relay'))
+        for _ in range(100):
+            if results:
+                break
+            await asyncio.sleep(0.02)
+        self.assertEqual(results, ['pong'])
+
+    async def test_sync_call(self):
+        # a call of a synchronous rpc object waits for the coroutine handler
+        async def double(value=None):
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        async def fail():
+            raise ValueError('failed')
+        self.server.handle(double, 'double')
+        self.server.handle(fail, 'fail')
+        sync = rpc('sync-' + self.client.name)
+        loop = asyncio.get_running_loop()
+        self.assertEqual(await loop.run_in_executor(None, lambda: sync.call(self.server.name, 'double', value=4)), 8)
+        with self.assertRaises(ValueError):
+            await loop.run_in_executor(None, lambda: sync.call(self.server.name, 'fail'))
+
+    async def test_sync_rpc(self):
+        sync = rpc('sync-' + self.client.name)
+        sync.handle(lambda value=None: value * 10, 'times')
+        stop = threading.Event()
+
+        def listen():
+            while not stop.is_set():
+                try:
+                    sync.transport.consume(timeout=0.1)
+                except socket.timeout:
+                    pass
+        thread = threading.Thread(target=listen)
+        thread.start()
+        try:
+            self.assertEqual(await self.client.call(sync.name, 'times', value=3), 30)
+        finally:
+            stop.set()
+            thread.join()
+
+
+class NotStartedTest(unittest.TestCase):
+    def setUp(self):
+        self.config = domos.util.rpc.domosSettings.getExchangeConfig
+        domos.util.rpc.domosSettings.getExchangeConfig = staticmethod(lambda: {'transport': 'local'})
+
+    def tearDown(self):
+        domos.util.rpc.domosSettings.getExchangeConfig = self.config
+
+    def test_call_before_start(self):
+        client = asyncrpc('client-' + uuid.uuid4().hex)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(client.call('nobody', 'missing'))
+
+    def test_start_without_loop(self):
+        with self.assertRaises(RuntimeError):
+            asyncrpc('client-' + uuid.uuid4().hex).start()
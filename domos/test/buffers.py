@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+from domos.util.ringbuffer import ringbuffer
+import datetime
+import unittest
+
+
+class RingBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = ringbuffer(4)
+        self.start = datetime.datetime(2020, 1, 1)
+
+    def fill(self, values):
+        for second, value in enumerate(values):
+            self.buffer.append(value, self.start + datetime.timedelta(seconds=second))
+
+    def test_empty(self):
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.last(), 0)
+        self.assertEqual(self.buffer.sum(3), 0)
+        self.assertEqual(self.buffer.avg(3), 0)
+        self.assertEqual(self.buffer.diff(), 0)
+
+    def test_sums_across_rebase(self):
+        values = []
+        # the running sums are rebased every 4 values
+        for value in [1.5, 2.0, -3.0, 4.25, 10.0, 6.0, 7.5, -8.0, 9.0, 0.5, 11.0]:
+            self.buffer.append(value, self.start)
+            values.append(value)
+            for num in range(1, 5):
+                with self.subTest(values=len(values), num=num):
+                    window = values[-num:]
+                    self.assertAlmostEqual(self.buffer.sum(num), sum(window))
+                    self.assertAlmostEqual(self.buffer.avg(num), sum(window) / len(window))
+                    if num <= len(values):
+                        self.assertEqual(self.buffer.last(num), values[-num])
+
+    def test_precision(self):
+        for value in range(100000):
+            self.buffer.append(1e6 + value, self.start)
+        self.assertEqual(self.buffer.sum(4), sum(1e6 + value for value in range(99996, 100000)))
+
+    def test_last_out_of_range(self):
+        self.fill([1.0, 2.0])
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.last(3), 0)
+        self.assertEqual(self.buffer.sum(4), 3.0)
+        self.assertEqual(self.buffer.avg(4), 1.5)
+
+    def test_diff(self):
+        self.fill([1.0, 4.0, 10.0, 3.0, 7.0])
+        self.assertEqual(self.buffer.diff(), 4.0)
+        self.assertEqual(self.buffer.tdiff(), 4.0)
+
+    def test_tdiff_same_time(self):
+        self.buffer.append(1.0, self.start)
+        self.buffer.append(2.0, self.start)
+        self.assertEqual(self.buffer.tdiff(), 0)
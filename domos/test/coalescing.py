@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+from domos.handlers import *
+import unittest
+
+
+class CoalescingQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.q = coalescingQueue(sensors=[1])
+
+    def drain(self):
+        items = []
+        while not self.q.empty():
+            items.append(self.q.get_nowait())
+        return items
+
+    def test_collapse(self):
+        self.q.put(("sensor", 1, 1.0))
+        self.q.put(("sensor", 2, 1.0))
+        self.q.put(("sensor", 1, 2.0))
+        self.q.put(("trigger", 1, 5.0))
+        self.q.put(("sensor", 1, 3.0))
+        self.assertEqual(self.drain(), [("sensor", 1, 3.0), ("sensor", 2, 1.0), ("trigger", 1, 5.0)])
+
+    def test_not_coalesced(self):
+        self.q.put(("sensor", 2, 1.0))
+        self.q.put(("sensor", 2, 2.0))
+        self.assertEqual(self.drain(), [("sensor", 2, 1.0), ("sensor", 2, 2.0)])
+
+    def test_set_coalesce(self):
+        self.q.set_coalesce(2)
+        self.q.set_coalesce(1, False)
+        for value in (1.0, 2.0):
+            self.q.put(("sensor", 1, value))
+            self.q.put(("sensor", 2, value))
+        self.assertEqual(self.drain(), [("sensor", 1, 1.0), ("sensor", 2, 2.0), ("sensor", 1, 2.0)])
+
+    def test_update_after_get(self):
+        self.q.put(("sensor", 1, 1.0))
+        self.assertEqual(self.q.get_nowait(), ("sensor", 1, 1.0))
+        self.q.put(("sensor", 1, 2.0))
+        self.assertEqual(self.drain(), [("sensor", 1, 2.0)])
+
+    def test_join(self):
+        for value in (1.0, 2.0, 3.0):
+            self.q.put(("sensor", 1, value))
+        self.q.put(("sensor", 2, 1.0))
+        self.assertEqual(self.q.unfinished_tasks, 2)
+        for item in self.drain():
+            self.q.task_done()
+        joined = threading.Thread(target=self.q.join)
+        joined.start()
+        joined.join(timeout=2)
+        self.assertFalse(joined.is_alive())
+        with self.assertRaises(ValueError):
+            self.q.task_done()
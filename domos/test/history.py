@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+from domos.handlers import *
+import unittest
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        dbconn.initialize(SqliteDatabase(':memory:'))
+        self.db = dbhandler()
+        self.db.connect()
+        self.db.create_tables()
+        self.db.init_tables()
+        module = Module.create(name='test', queue='test', active=True)
+        rpctype = RPCType.get(RPCType.rpctype == 'add')
+        modulerpc = ModuleRPC.create(module=module, rpctype=rpctype, key='add')
+        self.sensor = Sensor.create(modulerpc=modulerpc, name='sensor')
+        self.start = datetime.datetime(2020, 1, 1)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_rollup_within_points(self):
+        for day in range(365):
+            SensorRollupDay.create(sensor=self.sensor, timestamp=self.start + datetime.timedelta(days=day),
+                                   minimum=day, maximum=day + 1, total=2.0 * day, count=2, last=day)
+        rows = self.sensor.history(self.start, self.start + datetime.timedelta(days=365), 100)
+        self.assertLessEqual(len(rows), 100)
+        self.assertEqual(sum(row['count'] for row in rows), 730)
+        self.assertEqual(rows[0]['min'], 0)
+        self.assertEqual(rows[-1]['max'], 365)
+        self.assertEqual(rows[-1]['last'], 364)
+        self.assertAlmostEqual(sum(row['avg'] * row['count'] for row in rows), 2.0 * sum(range(365)))
+
+    def test_raw_values(self):
+        # the periods are shorter than a minute, the raw values are used
+        for second in range(0, 300, 5):
+            SensorValue.create(sensor=self.sensor, numeric=float(second),
+                               timestamp=self.start + datetime.timedelta(seconds=second))
+        end = self.start + datetime.timedelta(minutes=5)
+        self.assertEqual(len(self.sensor.history(self.start, end, 100)), 60)
+        rows = self.sensor.history(self.start, end, 6)
+        self.assertEqual([row['count'] for row in rows], [10] * 6)
+        self.assertEqual([row['avg'] for row in rows], [22.5 + 50 * num for num in range(6)])
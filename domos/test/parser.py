@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from domos.util.trigger import *
+from domos.handlers import *
 import unittest
 import pprint
 
@@ -39,6 +39,32 @@ class ParserTest(unittest.TestCase):
                 print("result:", result)
                 self.assertEqual(result, expect)
 
+    def test_compiled(self):
+        for rule, expect in TESTS:
+            with self.subTest(i=rule):
+                tree = expressions.parse(rule)
+                compiled = Compiler().compile(tree, rule)
+                self.assertEqual(compiled(self.sensorvars, self.triggervars), expect)
+                loaded = compiledexpression.loads(compiled.dumps())
+                self.assertEqual(loaded(self.sensorvars, self.triggervars), expect)
+
+    def test_stored_tree(self):
+        # stored trees are checked against the grammar, they can not inject code
+        trees = [
+            ['number', '__import__("os")'],
+            ['sensor', "__sens1__') or __import__('os"],
+            ['add', ['number', '1'], ['add_symbol', ';'], ['number', '2']],
+            ['call', '__import__'],
+            ['start', ['number', '1'], ['number', '2']],
+            'start',
+        ]
+        for tree in trees:
+            with self.subTest(tree=tree):
+                with self.assertRaises(ValueError):
+                    Compiler().compile(tree, 'x')
+                self.assertIsNone(compiledexpression.loads(expressions.dumps('x', tree)))
+        self.assertIsNone(compiledexpression.loads(b'not json'))
+
 
 def parsertest():
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+from domos.handlers import *
+import domos.util.partitions as partitions
+import unittest
+
+
+class PartitionTest(unittest.TestCase):
+    def setUp(self):
+        database = SqliteDatabase(':memory:')
+        dbconn.initialize(database)
+        SensorValue.partitions = partitions.layout(SensorValue, database)
+        self.db = dbhandler()
+        self.db.connect()
+        self.db.create_tables()
+        self.db.init_tables()
+        module = Module.create(name='test', queue='test', active=True)
+        rpctype = RPCType.get(RPCType.rpctype == 'add')
+        modulerpc = ModuleRPC.create(module=module, rpctype=rpctype, key='add')
+        self.sensor = Sensor.create(modulerpc=modulerpc, name='sensor')
+
+    def tearDown(self):
+        SensorValue.partitions = None
+        self.db.close()
+
+    def store(self, *timestamps):
+        for timestamp in timestamps:
+            SensorValue.partitions.ensure(timestamp)
+        rows = [{'sensor': self.sensor.id, 'numeric': float(num), 'timestamp': timestamp}
+                for num, timestamp in enumerate(timestamps)]
+        for model, group in SensorValue.split(rows):
+            model.insert_many(group).execute()
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            partitions.partitions(SensorValue)
+        with self.assertRaises(TypeError):
+            partitions.rangepartitions(SensorValue)
+
+    def test_routing(self):
+        SensorValue.partitions.ensure(datetime.datetime(2020, 3, 1))
+        model = SensorValue.partition(datetime.datetime(2020, 3, 15))
+        self.assertEqual(model._meta.db_table, 'sensorvalue_202003')
+        self.assertIs(SensorValue.partition(datetime.datetime(2020, 3, 1)), model)
+        self.assertTrue(model.table_exists())
+        self.store(datetime.datetime(2020, 1, 31, 23, 59), datetime.datetime(2020, 2, 1),
+                   datetime.datetime(2020, 2, 29, 12), datetime.datetime(2020, 3, 2))
+        counts = {model._meta.db_table: model.select().count()
+                  for model in SensorValue.tables(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 3, 31))}
+        self.assertEqual(counts, {'sensorvalue_202001': 1, 'sensorvalue_202002': 2,
+                                  'sensorvalue_202003': 1, 'sensorvalue': 0})
+
+    def test_missing_partition(self):
+        # partitions are not created while writing values
+        self.assertIs(SensorValue.partition(datetime.datetime(2020, 4, 15)), SensorValue)
+        self.assertNotIn('sensorvalue_202004', dbconn.get_tables())
+        SensorValue.split([{'sensor': self.sensor.id, 'numeric': 1.0, 'timestamp': datetime.datetime(2020, 4, 15)}])
+        self.assertNotIn('sensorvalue_202004', dbconn.get_tables())
+
+    def test_upcoming(self):
+        now = datetime.datetime.now()
+        SensorValue.partitions.upcoming()
+        tables = dbconn.get_tables()
+        self.assertIn(SensorValue.partitions.name(partitions.month(now)), tables)
+        self.assertIn(SensorValue.partitions.name(partitions.nextmonth(now)), tables)
+        self.assertIsNot(SensorValue.partition(now), SensorValue)
+
+    def test_migrate_skips_partitioned(self):
+        changes = self.db.migrate()
+        self.assertIn('skipped partitioned table sensorvalue', changes)
+
+    def test_tables(self):
+        self.store(datetime.datetime(2020, 1, 10), datetime.datetime(2020, 2, 10), datetime.datetime(2020, 3, 10))
+        tables = [model._meta.db_table for model in
+                  SensorValue.tables(datetime.datetime(2020, 2, 15), datetime.datetime(2020, 3, 5))]
+        self.assertEqual(tables, ['sensorvalue_202003', 'sensorvalue_202002', 'sensorvalue'])
+        tables = [model._meta.db_table for model in SensorValue.tables(datetime.datetime(2020, 2, 1))]
+        self.assertEqual(tables[-1], 'sensorvalue')
+        self.assertNotIn('sensorvalue_202001', tables)
+        self.assertIn('sensorvalue_202002', tables)
+
+    def test_drop(self):
+        self.store(datetime.datetime(2020, 1, 10), datetime.datetime(2020, 2, 10), datetime.datetime(2020, 3, 10))
+        dropped = SensorValue.partitions.drop(datetime.datetime(2020, 3, 1))
+        self.assertEqual(dropped, ['sensorvalue_202001', 'sensorvalue_202002'])
+        tables = dbconn.get_tables()
+        self.assertNotIn('sensorvalue_202001', tables)
+        self.assertNotIn('sensorvalue_202002', tables)
+        self.assertIn('sensorvalue_202003', tables)
+        self.assertIn('sensorvalue', tables)
+        # a partition with values after the cut off is kept
+        self.assertEqual(SensorValue.partitions.drop(datetime.datetime(2020, 3, 20)), [])
+
+    def test_reload(self):
+        self.store(datetime.datetime(2020, 1, 10))
+        SensorValue.partitions = partitions.layout(SensorValue, dbconn.obj)
+        tables = [model._meta.db_table for model in SensorValue.tables(datetime.datetime(2020, 1, 1))]
+        self.assertIn('sensorvalue_202001', tables)
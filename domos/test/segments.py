@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+from domos.util.columnstore import columnstore
+import domos.util.columnstore
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ColumnStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = columnstore(self.path, capacity=8, stride=2)
+        self.start = datetime.datetime(2020, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def at(self, second):
+        return self.start + datetime.timedelta(seconds=second)
+
+    def fill(self, num):
+        for second in range(num):
+            self.assertTrue(self.store.append(1, float(second), self.at(second)))
+
+    def test_range(self):
+        # 30 values over 4 segments
+        self.fill(30)
+        self.assertEqual(len(os.listdir(os.path.join(self.path, '1'))), 4)
+        values = self.store.values(1, self.at(5), self.at(20))
+        self.assertEqual([value.reading for value in values], [float(second) for second in range(5, 21)])
+        self.assertEqual(values[0].timestamp, self.at(5))
+        self.assertEqual(len(self.store.values(1)), 30)
+        self.assertEqual(self.store.values(1, self.at(30)), [])
+        self.assertEqual(self.store.values(2), [])
+
+    def test_range_without_numpy(self):
+        numpy, domos.util.columnstore.numpy = domos.util.columnstore.numpy, None
+        try:
+            self.fill(20)
+            values = self.store.values(1, self.at(7), self.at(9))
+            self.assertEqual([value.reading for value in values], [7.0, 8.0, 9.0])
+        finally:
+            domos.util.columnstore.numpy = numpy
+
+    def test_last(self):
+        self.fill(20)
+        values = self.store.last(1, 10)
+        self.assertEqual([value.reading for value in values], [float(second) for second in range(19, 9, -1)])
+        self.assertEqual(len(self.store.last(1, 50)), 20)
+        self.assertEqual(self.store.last(2, 5), [])
+
+    def test_older_value(self):
+        self.fill(3)
+        self.assertFalse(self.store.append(1, 10.0, self.at(1)))
+        self.assertEqual(self.store.last(1, 1)[0].reading, 2.0)
+
+    def test_stats(self):
+        self.fill(20)
+        # values at the start of the window are not included, like the database
+        self.assertEqual(self.store.stats(1, self.at(16)), (3, 54.0, 17.0, 19.0))
+        self.assertEqual(self.store.stats(1, self.at(19)), (0, None, None, None))
+
+    def test_reopen(self):
+        self.fill(20)
+        self.store.flush()
+        store = columnstore(self.path, capacity=8, stride=2)
+        self.assertEqual([value.reading for value in store.last(1, 2)], [19.0, 18.0])
+        self.assertTrue(store.append(1, 20.0, self.at(20)))
+        self.assertEqual(len(store.values(1)), 21)
+
+    def test_mapped_segments(self):
+        self.fill(30)
+        segments = self.store._segments(1)
+        self.assertEqual([current.map is not None for current in segments], [False, False, False, True])
+        self.store.values(1)
+        self.store.last(1, 30)
+        self.assertEqual([current.map is not None for current in segments], [False, False, False, True])
+
+    def test_drop(self):
+        self.fill(30)
+        self.assertEqual(self.store.drop(1, self.at(17)), 16)
+        self.assertEqual(len(os.listdir(os.path.join(self.path, '1'))), 2)
+        self.assertEqual(self.store.values(1)[0].reading, 16.0)
+        # the last segment is kept
+        self.assertEqual(self.store.drop(1, self.at(100)), 8)
+        self.assertEqual([value.reading for value in self.store.values(1)], [24.0, 25.0, 26.0, 27.0, 28.0, 29.0])
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+from domos.server import MessageHandler
+import datetime
+import unittest
+
+
+class TimestampTest(unittest.TestCase):
+    def setUp(self):
+        self.local = datetime.datetime(2020, 6, 1, 12, 30, 15, 250000)
+        self.epoch = self.local.timestamp()
+
+    def test_now(self):
+        for timestamp in (None, ''):
+            with self.subTest(timestamp=timestamp):
+                before = datetime.datetime.now()
+                parsed = MessageHandler._timestamp(timestamp)
+                self.assertTrue(before <= parsed <= datetime.datetime.now())
+
+    def test_epoch(self):
+        self.assertEqual(MessageHandler._timestamp(self.epoch), self.local)
+        self.assertEqual(MessageHandler._timestamp(int(self.epoch)), self.local.replace(microsecond=0))
+
+    def test_epoch_string(self):
+        self.assertEqual(MessageHandler._timestamp(repr(self.epoch)), self.local)
+        self.assertEqual(MessageHandler._timestamp(str(int(self.epoch))), self.local.replace(microsecond=0))
+
+    def test_iso(self):
+        self.assertEqual(MessageHandler._timestamp('2020-06-01T12:30:15.250000'), self.local)
+        self.assertEqual(MessageHandler._timestamp('2020-06-01 12:30:15'), self.local.replace(microsecond=0))
+
+    def test_iso_timezone(self):
+        utc = self.local.astimezone(datetime.timezone.utc)
+        parsed = MessageHandler._timestamp(utc.isoformat())
+        self.assertIsNone(parsed.tzinfo)
+        self.assertEqual(parsed, self.local)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            MessageHandler._timestamp('yesterday')
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+from domos.util.transport import localtransport
+import socket
+import threading
+import unittest
+import uuid
+
+
+class broker:
+    """Stand in for the dashi transport of a queue, records the sent messages
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.handlers = {}
+
+    def handle(self, func, name):
+        self.handlers[name] = func
+
+    def fire(self, target, func, **kwargs):
+        self.sent.append((target, func, kwargs))
+
+    def call(self, target, func, timeout=5, **kwargs):
+        self.sent.append((target, func, kwargs))
+        return 'remote'
+
+    def consume(self, timeout=None):
+        threading.Event().wait(timeout)
+        raise socket.timeout()
+
+
+class LocalTransportTest(unittest.TestCase):
+    def setUp(self):
+        suffix = uuid.uuid4().hex
+        self.core = localtransport('core-' + suffix, {})
+        self.api = localtransport('api-' + suffix, {})
+        self.core.remote = self.api.remote = broker()
+        self.core.receiver = broker()
+        self.api.receiver = broker()
+
+    def consume(self, transport):
+        try:
+            transport.consume(timeout=0.5)
+        except socket.timeout:
+            pass
+
+    def test_owned_queue(self):
+        received = []
+        self.api.handle(lambda value=None: received.append(value), 'put')
+        self.core.fire(self.api.name, 'put', value=1)
+        self.consume(self.api)
+        self.assertEqual(received, [1])
+        self.assertEqual(self.core.remote.sent, [])
+
+    def test_other_process(self):
+        self.core.fire('module', 'setValue', value=1)
+        self.assertEqual(self.core.call('module', 'getValue'), 'remote')
+        self.assertEqual(self.core.remote.sent, [('module', 'setValue', {'value': 1}), ('module', 'getValue', {})])
+        self.assertNotIn('module', localtransport.queues)
+
+    def test_forward(self):
+        # messages from the broker are handled by the thread consuming the queue
+        threads = []
+
+        def double(value=None):
+            threads.append(threading.current_thread())
+            return value * 2
+        self.core.handle(double, 'double')
+        results = []
+        sender = threading.Thread(target=lambda: results.append(self.core.receiver.handlers['double'](value=2)))
+        sender.start()
+        self.consume(self.core)
+        sender.join()
+        self.assertEqual(results, [4])
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_forward_error(self):
+        self.core.handle(lambda: 1 / 0, 'fail')
+        errors = []
+
+        def send():
+            try:
+                self.core.receiver.handlers['fail']()
+            except ZeroDivisionError as err:
+                errors.append(err)
+        sender = threading.Thread(target=send)
+        sender.start()
+        self.consume(self.core)
+        sender.join()
+        self.assertEqual(len(errors), 1)
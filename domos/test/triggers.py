@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+from domos.handlers import *
+from domos.util.ringbuffer import bufferstore
+import unittest
+
+
+class TriggerTest(unittest.TestCase):
+    def setUp(self):
+        dbconn.initialize(SqliteDatabase(':memory:'))
+        self.db = dbhandler()
+        self.db.connect()
+        self.db.create_tables()
+        self.db.init_tables()
+        module = Module.create(name='test', queue='test', active=True)
+        rpctype = RPCType.get(RPCType.rpctype == 'add')
+        self.modulerpc = ModuleRPC.create(module=module, rpctype=rpctype, key='add')
+        self.sensor = Sensor.create(modulerpc=self.modulerpc, name='sensor')
+
+    def tearDown(self):
+        self.db.close()
+
+    def trigger(self, name, sensors=(), triggers=()):
+        expression = Expression.create(expression=name)
+        trigger = Trigger.create(name=name, expression=expression, record=False)
+        for sensor in sensors:
+            VarSensor.create(source=sensor, expression=expression, function='last', args='1')
+        for source in triggers:
+            VarTrigger.add(source, expression, 'last', '1')
+        return trigger
+
+    def test_cascade_order(self):
+        a = self.trigger('a', sensors=[self.sensor])
+        b = self.trigger('b', sensors=[self.sensor], triggers=[a])
+        c = self.trigger('c', triggers=[b, a])
+        d = self.trigger('d', triggers=[c])
+        index = triggerindex()
+        index.build()
+        order = [trigger.id for trigger in index.cascade(sensor=self.sensor.id)]
+        self.assertEqual(order, [a.id, b.id, c.id, d.id])
+        order = [trigger.id for trigger in index.cascade(trigger=b.id)]
+        self.assertEqual(order, [c.id, d.id])
+
+    def test_own_value(self):
+        a = self.trigger('a', sensors=[self.sensor])
+        VarTrigger.add(a, a.expression, 'last', '1')
+        self.assertFalse(a.depends_on(a))
+        index = triggerindex()
+        index.build()
+        self.assertEqual([trigger.id for trigger in index.cascade(sensor=self.sensor.id)], [a.id])
+
+    def test_cycle_rejected(self):
+        a = self.trigger('a', sensors=[self.sensor])
+        b = self.trigger('b', triggers=[a])
+        c = self.trigger('c', triggers=[b])
+        with self.assertRaises(cycleerror):
+            VarTrigger.add(c, a.expression, 'last', '1')
+        self.assertEqual(VarTrigger.select().where(VarTrigger.expression == a.expression).count(), 0)
+        self.assertTrue(c.depends_on(a))
+        self.assertFalse(a.depends_on(c))
+
+    def test_index_rejects_cycle(self):
+        a = self.trigger('a', sensors=[self.sensor])
+        b = self.trigger('b', triggers=[a])
+        index = triggerindex()
+        index.build()
+        # a cycle stored without VarTrigger.add
+        VarTrigger.create(source=b, expression=a.expression, function='last', args='1')
+        self.assertTrue(a.depends_on(a))
+        with self.assertRaises(cycleerror):
+            index.add_trigger(Trigger.get_by_id(a.id))
+        self.assertNotIn(a.id, index.triggers)
+
+    def test_window_pending(self):
+        a = self.trigger('a', sensors=[self.sensor])
+        a.record = True
+        a.save()
+        since = datetime.datetime.now() - datetime.timedelta(minutes=1)
+        TriggerValue.create(trigger=a, numeric=1.0, timestamp=since + datetime.timedelta(seconds=1))
+        Trigger.state = triggerState(interval=1000)
+        try:
+            a.add_value(5.0)
+            a.add_value(3.0)
+            self.assertEqual(a.window(fn.COUNT, since), 3)
+            self.assertEqual(a.window(fn.SUM, since), 9.0)
+            self.assertEqual(a.window(fn.MAX, since), 5.0)
+            Trigger.state.flush()
+            self.assertEqual(a.window(fn.SUM, since), 9.0)
+        finally:
+            Trigger.state = None
+
+    def test_sensor_window_pending(self):
+        since = datetime.datetime.now() - datetime.timedelta(minutes=1)
+        SensorValue.create(sensor=self.sensor, numeric=1.0, timestamp=since + datetime.timedelta(seconds=1))
+        SensorValue.writer = valueWriter(size=100, interval=1000, maxsize=100)
+        try:
+            SensorValue.writer.put(self.sensor.id, 5.0)
+            SensorValue.writer.put(self.sensor.id, 3.0)
+            self.assertEqual(self.sensor.window(fn.COUNT, since), 3)
+            self.assertEqual(self.sensor.window(fn.SUM, since), 9.0)
+            self.assertEqual([record.reading for record in self.sensor.lastrecords(2)], [3.0, 5.0])
+            rows = [SensorValue.writer.q.get_nowait() for _ in range(2)]
+            self.assertEqual(SensorValue.writer.flush(rows), [])
+            self.assertEqual(SensorValue.writer.pending(self.sensor.id), [])
+            self.assertEqual(self.sensor.window(fn.SUM, since), 9.0)
+        finally:
+            SensorValue.writer = None
+
+    def test_updated_sensor_window(self):
+        since = datetime.datetime.now() - datetime.timedelta(minutes=1)
+        SensorValue.create(sensor=self.sensor, numeric=1.0, timestamp=since + datetime.timedelta(seconds=1))
+        SensorValue.create(sensor=self.sensor, numeric=5.0)
+        expression = Expression.create(expression='window')
+        window = VarSensor.create(source=self.sensor, expression=expression, function='tavg', args='10m')
+        last = VarSensor.create(source=self.sensor, expression=expression, function='last', args='1')
+        expression.expression = '__sens{}__ * 10 + __sens{}__'.format(window.id, last.id)
+        expression.save()
+        calculator = matchcalculator(self.db, grammar=GRAMMAR)
+        self.assertEqual(float(calculator.resolve(expression, ('sensor', self.sensor.id, 5.0))), 35.0)
+
+    def test_updated_sensor_average(self):
+        for value in (1.0, 2.0, 3.0):
+            SensorValue.create(sensor=self.sensor, numeric=value)
+        expression = Expression.create(expression='average')
+        average = VarSensor.create(source=self.sensor, expression=expression, function='avg', args='3')
+        expression.expression = '__sens{}__'.format(average.id)
+        expression.save()
+        ops.buffers = bufferstore()
+        try:
+            ops.buffers.warm()
+            # the core adds a value to the buffers before the triggers are checked
+            ops.buffers.append(self.sensor.id, 7.0, datetime.datetime.now())
+            calculator = matchcalculator(self.db, grammar=GRAMMAR)
+            self.assertEqual(float(calculator.resolve(expression, ('sensor', self.sensor.id, 7.0))), 4.0)
+        finally:
+            ops.buffers = None
@@ -0,0 +1,296 @@
+import bisect
+import datetime
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+record = struct.Struct('<dd')
+count = struct.Struct('<q')
+dtype = [('timestamp', '<f8'), ('value', '<f8')]
+
+storedvalue = namedtuple('storedvalue', ['timestamp', 'reading'])
+
+
+class segment:
+    """A fixed size file of (timestamp, value) records. The first record slot
+    holds the number of records, it is updated after the record is written so
+    readers never see a partial record. The file is mapped in memory while the
+    segment is used as a context manager, the segment being appended to stays mapped until it is full
+
+    :param path: File of the segment, created if it does not exist
+    :param capacity: Number of records in a new segment
+    :param stride: Number of records between the entries of the sparse time index
+    """
+
+    def __init__(self, path, capacity, stride):
+        self.path = path
+        self.stride = stride
+        if not os.path.exists(path):
+            with open(path, 'wb') as file:
+                file.truncate((capacity + 1) * record.size)
+        self.capacity = os.path.getsize(path) // record.size - 1
+        self.index = []
+        self.map = None
+        self.users = 0
+        self.active = False
+        self.filled = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        with self.lock:
+            if self.map is None:
+                with open(self.path, 'r+b') as file:
+                    self.map = mmap.mmap(file.fileno(), 0)
+            self.users += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.users -= 1
+            if not self.users and not (self.active and len(self) < self.capacity):
+                self._close()
+
+    def _close(self):
+        if self.active:
+            self.map.flush()
+            self.active = False
+        try:
+            self.map.close()
+        except BufferError:
+            # slices returned by slice() still use the mapping, it is closed when they are released
+            pass
+        self.map = None
+
+    def __len__(self):
+        return count.unpack_from(self.map, 0)[0]
+
+    @property
+    def full(self):
+        if not self.filled:
+            with self:
+                self.filled = len(self) >= self.capacity
+        return self.filled
+
+    def timestamp(self, position):
+        return struct.unpack_from('<d', self.map, (position + 1) * record.size)[0]
+
+    def record(self, position):
+        return record.unpack_from(self.map, (position + 1) * record.size)
+
+    def append(self, timestamp, value):
+        position = len(self)
+        record.pack_into(self.map, (position + 1) * record.size, timestamp, value)
+        count.pack_into(self.map, 0, position + 1)
+
+    def _index(self):
+        """Returns the sparse time index, extended with the records appended since the last call
+        """
+        for position in range(len(self.index) * self.stride, len(self), self.stride):
+            self.index.append(self.timestamp(position))
+        return self.index
+
+    def find(self, timestamp):
+        """Returns the position of the first record at or after a point in time
+
+        :param timestamp: Seconds since the epoch
+        """
+        index = self._index()
+        block = bisect.bisect_left(index, timestamp)
+        low = max(block - 1, 0) * self.stride
+        high = min(block * self.stride, len(self))
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def slice(self, start, end):
+        """Returns the records from position start up to end without copying them,
+        a numpy record array if numpy is available, else a memoryview of alternating timestamps and values
+        """
+        if numpy is not None:
+            return numpy.frombuffer(self.map, dtype=dtype, count=end - start, offset=(start + 1) * record.size)
+        return memoryview(self.map)[(start + 1) * record.size:(end + 1) * record.size].cast('d')
+
+    def flush(self):
+        with self:
+            self.map.flush()
+
+
+class columnstore:
+    """Append only store of the numeric values of sensors. The values of a sensor
+    are stored in a directory per sensor as numbered segment files. Timestamps
+    of a sensor have to increase, :meth:`append` refuses older values
+
+    :param path: Directory of the store
+    :param capacity: Number of values per segment file
+    :param stride: Number of values between the entries of the sparse time index of a segment
+    """
+
+    def __init__(self, path, capacity=65536, stride=256):
+        self.path = path
+        self.capacity = capacity
+        self.stride = stride
+        self.segments = {}
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _directory(self, sensor):
+        return os.path.join(self.path, str(int(sensor)))
+
+    def _segments(self, sensor):
+        """Returns the segments of a sensor, oldest first. The directory is read
+        again when the last segment is full, a new segment may have been added by another process
+        """
+        sensor = int(sensor)
+        with self.lock:
+            segments = self.segments.get(sensor)
+            if segments is None or (segments and segments[-1].full):
+                known = {os.path.basename(current.path): current for current in segments or []}
+                directory = self._directory(sensor)
+                names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+                segments = [known[name] if name in known else
+                            segment(os.path.join(directory, name), self.capacity, self.stride)
+                            for name in names if name.endswith('.seg')]
+                self.segments[sensor] = segments
+            return list(segments)
+
+    def append(self, sensor, value, timestamp):
+        """Append a value of a sensor, returns False if the value is older than the last stored value
+
+        :param sensor: ID of the sensor
+        :param value: The value, a float
+        :param timestamp: Time of the value, a datetime object
+        """
+        timestamp = timestamp.timestamp()
+        segments = self._segments(sensor)
+        if segments:
+            with segments[-1] as current:
+                if len(current) and current.timestamp(len(current) - 1) > timestamp:
+                    return False
+                if not current.full:
+                    current.active = True
+                    current.append(timestamp, value)
+                    return True
+        directory = self._directory(sensor)
+        os.makedirs(directory, exist_ok=True)
+        number = int(os.path.basename(segments[-1].path)[:-4]) + 1 if segments else 0
+        new = segment(os.path.join(directory, '{:08d}.seg'.format(number)), self.capacity, self.stride)
+        with self.lock:
+            self.segments[int(sensor)].append(new)
+        with new:
+            new.active = True
+            new.append(timestamp, value)
+        return True
+
+    def flush(self):
+        """Write the appended values to disk
+        """
+        with self.lock:
+            segments = [current[-1] for current in self.segments.values() if current]
+        for current in segments:
+            if current.active:
+                current.flush()
+
+    def _range(self, sensor, start, end):
+        slices = []
+        for current in self._segments(sensor):
+            with current:
+                length = len(current)
+                if not length or current.timestamp(0) > end or current.timestamp(length - 1) < start:
+                    continue
+                first = current.find(start)
+                last = current.find(math.nextafter(end, math.inf)) if end != math.inf else length
+                if last > first:
+                    slices.append(current.slice(first, last))
+        return slices
+
+    def range(self, sensor, start=None, end=None):
+        """Returns the values of a sensor between two points in time as a list
+        of slices per segment, see :meth:`segment.slice`
+
+        :param start: Start of the time range, unbounded if not given
+        :param end: End of the time range, unbounded if not given
+        """
+        return self._range(sensor, start.timestamp() if start else -math.inf, end.timestamp() if end else math.inf)
+
+    @staticmethod
+    def _columns(part):
+        if numpy is not None:
+            return part['timestamp'], part['value']
+        return part[0::2], part[1::2]
+
+    def values(self, sensor, start=None, end=None):
+        """Returns the values of a sensor between two points in time, oldest first
+
+        :rtype: A list of storedvalue tuples
+        """
+        values = []
+        for part in self.range(sensor, start, end):
+            timestamps, readings = self._columns(part)
+            values.extend(storedvalue(datetime.datetime.fromtimestamp(timestamp), float(reading))
+                          for timestamp, reading in zip(timestamps, readings))
+        return values
+
+    def last(self, sensor, num):
+        """Returns the last values of a sensor, newest first
+
+        :param num: Number of values to return
+        :rtype: A list of storedvalue tuples
+        """
+        values = []
+        for current in reversed(self._segments(sensor)):
+            with current:
+                position = len(current)
+                while position and len(values) < num:
+                    position -= 1
+                    timestamp, reading = current.record(position)
+                    values.append(storedvalue(datetime.datetime.fromtimestamp(timestamp), reading))
+            if len(values) >= num:
+                break
+        return values
+
+    def stats(self, sensor, since):
+        """Returns the number, sum, minimum and maximum of the values of a sensor after a point in time
+        """
+        parts = [self._columns(part)[1] for part in self._range(sensor, math.nextafter(since.timestamp(), math.inf),
+                                                                 math.inf)]
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return 0, None, None, None
+        if numpy is not None:
+            values = numpy.concatenate(parts)
+            return len(values), float(values.sum()), float(values.min()), float(values.max())
+        return (sum(len(part) for part in parts),
+                math.fsum(math.fsum(part) for part in parts),
+                min(min(part) for part in parts),
+                max(max(part) for part in parts))
+
+    def drop(self, sensor, before):
+        """Delete the segments of a sensor of which all values are older than a point in time
+
+        :rtype: The number of deleted values
+        """
+        before = before.timestamp()
+        dropped = 0
+        segments = self._segments(sensor)
+        for current in segments[:-1]:
+            with current:
+                length = len(current)
+                if current.timestamp(length - 1) >= before:
+                    break
+            with self.lock:
+                self.segments[int(sensor)].remove(current)
+            dropped += length
+            os.remove(current.path)
+        return dropped
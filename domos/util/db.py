@@ -1,4 +1,10 @@
 from peewee import *
+import playhouse.migrate
+import playhouse.pool
+import domos.util.partitions as partitions
+import domos.util.columnstore as columnstore
+import domos.util.expression as expressions
+from plyplus import ParseError, TokenizeError
 import datetime
 import math
 import statistics
@@ -72,6 +78,82 @@ class BaseModel(Model):
         return self
 
 
+class PartitionedModel(BaseModel):
+    """Base of the value tables which can be split in monthly partitions,
+    see :mod:`domos.util.partitions`. Without partitions all values are in a single table
+    """
+    partitions = None
+
+    @classmethod
+    def partition(cls, timestamp):
+        """Returns the model to store a value of a point in time in
+
+        :param timestamp: Time of the value
+        """
+        if cls.partitions is None:
+            return cls
+        return cls.partitions.table(timestamp)
+
+    @classmethod
+    def tables(cls, start=None, end=None):
+        """Returns the models holding the values between two points in time, newest first
+
+        :param start: Start of the time range, unbounded if not given
+        :param end: End of the time range, unbounded if not given
+        """
+        if cls.partitions is None:
+            return [cls]
+        return cls.partitions.tables(start, end)
+
+    @classmethod
+    def split(cls, rows):
+        """Group rows by the partition they are stored in
+
+        :param rows: A list of field dicts with a timestamp
+        :rtype: A list of (model, rows) tuples
+        """
+        if cls.partitions is None:
+            return [(cls, rows)]
+        groups = {}
+        for row in rows:
+            groups.setdefault(cls.partition(row['timestamp']), []).append(row)
+        return list(groups.items())
+
+    @classmethod
+    def aggregate(cls, aggregate, where, since, stats=None):
+        """Returns an aggregate of the numeric values since a point in time over all partitions
+
+        :param aggregate: The SQL aggregate function, one of fn.AVG, fn.MIN, fn.MAX, fn.SUM or fn.COUNT
+        :param where: Function returning the condition on the values of a model
+        :param since: Only values after this time are used
+        :param stats: List of number, sum, minimum and maximum tuples of values stored elsewhere to include
+        """
+        tables = cls.tables(since)
+        if len(tables) == 1 and not stats:
+            return tables[0].select(aggregate(tables[0].numeric)).where(
+                where(tables[0]) & (tables[0].timestamp > since)).scalar()
+        rows = [table.select(fn.COUNT(table.numeric), fn.SUM(table.numeric),
+                             fn.MIN(table.numeric), fn.MAX(table.numeric)).where(
+            where(table) & (table.timestamp > since)).tuples().get() for table in tables]
+        rows.extend(stats or [])
+        count, total, minimum, maximum = 0, 0, [], []
+        for row in rows:
+            if row[0]:
+                count += row[0]
+                total += row[1]
+                minimum.append(row[2])
+                maximum.append(row[3])
+        name = aggregate(cls.numeric).name.upper()
+        if name == 'COUNT':
+            return count
+        if not count:
+            return None
+        return {'AVG': lambda: total / count,
+                'SUM': lambda: total,
+                'MIN': lambda: min(minimum),
+                'MAX': lambda: max(maximum)}[name]()
+
+
 class Module(BaseModel):
     """Model of a module
 
@@ -211,15 +293,27 @@ class Sensor(BaseModel):
     * ident: identifier of the sensor
     * active: Whether the sensor is active or disabled
     * instant: is the sensor of the type Instant
+    * coalesce: Only check triggers with the latest of the pending values of this sensor
+    * numeric: Whether the values of the sensor are stored as numbers or as text
+    * retention: Days to keep the values of the sensor, the core default if not set
+    * rollupretention: Days to keep the rollups of the sensor, the core default if not set
     """
     translations = [('name', 'name'),
                     ('active', 'active'),
                     ('instant', 'instant'),
+                    ('coalesce', 'coalesce'),
+                    ('numeric', 'numeric'),
+                    ('retention', 'retention'),
+                    ('rollupretention', 'rollupretention'),
                     ('desc', 'des')]
     modulerpc = ForeignKeyField(ModuleRPC, related_name='sensors', on_delete='CASCADE')
     name = CharField()
     active = BooleanField(default=True)
     instant = BooleanField(default=False)
+    coalesce = BooleanField(default=False)
+    numeric = BooleanField(default=True)
+    retention = IntegerField(null=True)
+    rollupretention = IntegerField(null=True)
     desc = TextField(null=True)
 
     @classmethod
@@ -265,12 +359,19 @@ class Sensor(BaseModel):
         """
         return Sensor.get(Sensor.name == name)
 
-    def add_value(self, value):
+    def add_value(self, value, timestamp=None):
         """add a :class:`SensorValue` to the database for this :class:`Sensor`
 
         :param value: The value to add to the database
+        :param timestamp: Time the value was measured, the current time if not given
         """
-        value = SensorValue.create(sensor=self, value=str(value))
+        if self.numeric:
+            row = SensorValue.row(self, float(value), timestamp)
+            if SensorValue.store is not None and SensorValue.store.append(self.id, row['numeric'], row['timestamp']):
+                return
+        else:
+            row = SensorValue.row(self, value, timestamp)
+        SensorValue.partition(row['timestamp']).create(**row)
 
     def lastrecords(self, num):
         """Returns a list of the last values of this sensor
@@ -280,37 +381,244 @@ class Sensor(BaseModel):
         """
         if self.instant:
             return []
-        else:
-            return SensorValue.select().where(SensorValue.sensor == self).order_by(SensorValue.timestamp.desc()).limit(
-                num).naive()
+        records = SensorValue.writer.pending(self.id)[:num] if SensorValue.writer is not None else []
+        if SensorValue.store is not None and self.numeric and len(records) < num:
+            records.extend(SensorValue.store.last(self.id, num - len(records)))
+        before = records[-1].timestamp if records else None
+        for table in SensorValue.tables(end=before):
+            if len(records) >= num:
+                break
+            query = table.select().where(table.sensor == self)
+            if before:
+                query = query.where(table.timestamp < before)
+            records.extend(query.order_by(table.timestamp.desc()).limit(num - len(records)).naive())
+        return records
 
-
-class SensorValue(BaseModel):
+    @staticmethod
+    def _buckets(rows, start, width, points):
+        """Merges a sorted list of history dicts in points periods of width seconds from start,
+        rows outside of the periods are merged into the first or the last period
+        """
+        buckets = []
+        for row in rows:
+            index = min(points - 1, max(0, int((row['timestamp'] - start).total_seconds() // width)))
+            timestamp = start + datetime.timedelta(seconds=width * index)
+            if buckets and buckets[-1]['timestamp'] == timestamp:
+                bucket = buckets[-1]
+                bucket['min'] = min(bucket['min'], row['min'])
+                bucket['max'] = max(bucket['max'], row['max'])
+                bucket['avg'] += row['avg'] * row['count']
+                bucket['count'] += row['count']
+                bucket['last'] = row['last']
+            else:
+                buckets.append({'timestamp': timestamp,
+                                'min': row['min'],
+                                'max': row['max'],
+                                'avg': row['avg'] * row['count'],
+                                'count': row['count'],
+                                'last': row['last']})
+        for bucket in buckets:
+            bucket['avg'] /= bucket['count']
+        return buckets
+
+    def history(self, start, end, points):
+        """Returns the values of this sensor between two points in time. The
+        coarsest rollup table with periods no longer than the requested number
+        of points allows is used, the raw values if the periods of all tables are
+        too long. The rows are merged in periods when there are more than the requested number of points.
+
+        :param start: Start of the time range
+        :param end: End of the time range
+        :param points: Number of points wanted in the time range
+        :rtype: A list of dicts with timestamp, min, max, avg, count and last
+        """
+        span = (end - start).total_seconds()
+        width = span / points if points > 0 else 0
+        rows = None
+        for table in reversed(rolluptables):
+            if table.resolution <= width:
+                query = table.select().where((table.sensor == self) &
+                                             (table.timestamp >= table.period(start)) &
+                                             (table.timestamp <= end)).order_by(table.timestamp)
+                rows = [row.to_dict() for row in query]
+                break
+        if rows is None:
+            values = []
+            for table in reversed(SensorValue.tables(start, end)):
+                query = table.select().where((table.sensor == self) &
+                                             (table.timestamp >= start) &
+                                             (table.timestamp <= end) &
+                                             table.numeric.is_null(False)).order_by(table.timestamp)
+                values += [(row.timestamp, row.numeric) for row in query]
+            if SensorValue.store is not None and self.numeric:
+                values = sorted(values + SensorValue.store.values(self.id, start, end))
+            rows = [{'timestamp': timestamp,
+                     'min': value,
+                     'max': value,
+                     'avg': value,
+                     'count': 1,
+                     'last': value} for timestamp, value in values]
+        if len(rows) > points > 0 and span > 0:
+            return self._buckets(rows, start, width, points)
+        return rows
+
+    def window(self, aggregate, since):
+        """Returns an aggregate of the numeric values of this sensor since a point in time,
+        calculated by the database including the values not yet written by the value writer
+
+        :param aggregate: The SQL aggregate function, ie: fn.AVG
+        :param since: Only values after this time are used
+        """
+        if self.instant:
+            return 0
+        stats = []
+        if SensorValue.store is not None and self.numeric:
+            stats.append(SensorValue.store.stats(self.id, since))
+        if SensorValue.writer is not None:
+            values = [record.numeric for record in SensorValue.writer.pending(self.id)
+                      if record.numeric is not None and record.timestamp > since]
+            if values:
+                stats.append((len(values), math.fsum(values), min(values), max(values)))
+        result = SensorValue.aggregate(aggregate, lambda table: table.sensor == self, since, stats)
+        return 0 if result is None else result
+
+
+class SensorValue(PartitionedModel):
     """Values of a sensor, represents a measurement value
-    of the sensor at a certain point in time
+    of the sensor at a certain point in time. When a column store is configured
+    the numeric values are stored there instead, see :mod:`domos.util.columnstore`
 
     * sensor: associated :class:`Sensor`
-    * value: measurement value
+    * value: measurement value of text sensors
+    * numeric: measurement value of numeric sensors
     * timestamp: Point in time of the value
     """
     translations = [('value', 'value'),
+                    ('numeric', 'numeric'),
                     ('timestamp', 'timestamp'),
                     ('descr', 'des')]
     sensor = ForeignKeyField(Sensor, related_name='values', on_delete='CASCADE')
-    value = CharField()
+    value = CharField(null=True)
+    numeric = DoubleField(null=True)
     timestamp = DateTimeField(default=datetime.datetime.now)
 
-    class meta:
-        order_by = ('-Timestamp',)
+    store = None
+    writer = None
+
+    class Meta:
         indexes = (
-            (('Sensor', 'Timestamp'), True)
+            (('sensor', 'timestamp', 'numeric'), False),
         )
 
+    @property
+    def reading(self):
+        """The value of this record, a float for numeric values
+        """
+        if self.numeric is None:
+            return self.value
+        return self.numeric
+
+    @staticmethod
+    def row(sensor, value, timestamp=None):
+        """Returns the field dict of a value, floats and integers are stored in
+        the numeric column, other values as text
+
+        :param sensor: The :class:`Sensor` or its ID
+        :param value: The value of the sensor
+        :param timestamp: Time of the value, the current time if not given
+        """
+        row = {'sensor': sensor,
+               'value': None,
+               'numeric': None,
+               'timestamp': timestamp or datetime.datetime.now()}
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            row['numeric'] = value
+        else:
+            row['value'] = str(value)
+        return row
+
     @classmethod
     def insert_many(cls, rows):
         return super().insert_many(rows)
 
 
+class SensorRollup(BaseModel):
+    """Aggregated numeric values of a sensor over a period of time, base of the rollup tables
+
+    * sensor: associated :class:`Sensor`
+    * timestamp: Start of the period
+    * minimum: Lowest value in the period
+    * maximum: Highest value in the period
+    * total: Sum of the values in the period
+    * count: Number of values in the period
+    * last: Last value in the period
+    """
+    translations = [('timestamp', 'timestamp'),
+                    ('minimum', 'min'),
+                    ('maximum', 'max'),
+                    ('average', 'avg'),
+                    ('count', 'count'),
+                    ('last', 'last')]
+    sensor = ForeignKeyField(Sensor, on_delete='CASCADE')
+    timestamp = DateTimeField()
+    minimum = DoubleField()
+    maximum = DoubleField()
+    total = DoubleField()
+    count = IntegerField()
+    last = DoubleField()
+
+    resolution = None
+
+    @property
+    def average(self):
+        return self.total / self.count
+
+    @classmethod
+    def period(cls, timestamp):
+        """Returns the start of the period containing the timestamp
+
+        :param timestamp: a datetime object
+        """
+        seconds = (timestamp - datetime.datetime.min).total_seconds()
+        return datetime.datetime.min + datetime.timedelta(seconds=seconds - seconds % cls.resolution)
+
+
+class SensorRollupMinute(SensorRollup):
+    """Values of a sensor aggregated per minute
+    """
+    resolution = 60
+
+    class Meta:
+        indexes = (
+            (('sensor', 'timestamp'), True),
+        )
+
+
+class SensorRollupHour(SensorRollup):
+    """Values of a sensor aggregated per hour
+    """
+    resolution = 3600
+
+    class Meta:
+        indexes = (
+            (('sensor', 'timestamp'), True),
+        )
+
+
+class SensorRollupDay(SensorRollup):
+    """Values of a sensor aggregated per day
+    """
+    resolution = 86400
+
+    class Meta:
+        indexes = (
+            (('sensor', 'timestamp'), True),
+        )
+
+
+rolluptables = [SensorRollupMinute, SensorRollupHour, SensorRollupDay]
+
+
 class SensorArg(BaseModel):
     """Argument of a sensor, combination of a :class:`RPCArg` and a :class:`Sensor`
 
@@ -346,16 +654,28 @@ class SensorArg(BaseModel):
         :param sensor: The sensor to retrieve the argument dictionary for
         :rtype: A dict with argument keys and values
         """
-        sensorargs = SensorArg.select().where(SensorArg.sensor == sensor)
-        kwargs = {}
-        for sensorarg in sensorargs:
-            value = sensorarg.value
-            rpcarg = sensorarg.rpcarg
-            key, value = SensorArg._to_dict(kwargs, rpcarg.name, value)
-            kwargs[key] = value
-        kwargs['key'] = sensor.id
-        kwargs['name'] = sensor.name
-        return kwargs
+        return SensorArg.get_dicts([sensor])[sensor.id]
+
+    @staticmethod
+    def get_dicts(sensors):
+        """Creates the argument dicts of a list of sensors, the arguments
+        are fetched with one query per 500 sensors
+
+        :param sensors: A list of :class:`Sensor`
+        :rtype: A dict with the argument dict of every sensor by sensor ID
+        """
+        dicts = {sensor.id: {} for sensor in sensors}
+        ids = list(dicts)
+        for start in range(0, len(ids), 500):
+            sensorargs = SensorArg.select(SensorArg.sensor, SensorArg.value, RPCArg.name).join(RPCArg).where(
+                SensorArg.sensor << ids[start:start + 500]).tuples()
+            for sensor, value, name in sensorargs:
+                key, value = SensorArg._to_dict(dicts[sensor], name, value)
+                dicts[sensor][key] = value
+        for sensor in sensors:
+            dicts[sensor.id]['key'] = sensor.id
+            dicts[sensor.id]['name'] = sensor.name
+        return dicts
 
 
 class Macro(BaseModel):
@@ -370,12 +690,22 @@ class Expression(BaseModel):
     """Table that contains expressions used by other tables
 
     * expression: String containing the expression
-    * pickled: binary blob containing the pickled AST of the expression
+    * pickled: The syntax tree of the expression as json, see :mod:`domos.util.expression`
     """
     translations = [('expression', 'expression')]
     expression = CharField()
     pickled = BlobField(null=True)
 
+    def save(self, *args, **kwargs):
+        """Save the expression, the stored syntax tree is updated before saving.
+        An expression which can not be parsed is saved without syntax tree
+        """
+        try:
+            self.pickled = expressions.dumps(self.expression)
+        except (ParseError, TokenizeError):
+            self.pickled = None
+        return super().save(*args, **kwargs)
+
     def get_used_sensors(self):
         return VarSensor.select(VarSensor, Sensor).join(Sensor).where(VarSensor.expression == self)
 
@@ -389,15 +719,20 @@ class Trigger(BaseModel):
     * name: Name of the trigger
     * expression: foreign, class:`Expression` on which the trigger activates
     * record: Whether to log this trigger to the triggervalues table
-    * lastvalue: Last calculated value of this trigger
+    * lastvalue: Last calculated value of this trigger, a float
+    * retention: Days to keep the recorded values of the trigger, the core default if not set
     """
     translations = [('name', 'name'),
                     ('record', 'record'),
-                    ('lastvalue', 'lastvalue')]
+                    ('lastvalue', 'lastvalue'),
+                    ('retention', 'retention')]
     name = CharField()
     expression = ForeignKeyField(Expression)
     record = BooleanField()
-    lastvalue = CharField(null=True, default="null")
+    lastvalue = DoubleField(null=True)
+    retention = IntegerField(null=True)
+
+    state = None
 
     def get_affected_triggers(self):
         """Returns all triggers that have this trigger in their :class:`Expression`
@@ -442,46 +777,116 @@ class Trigger(BaseModel):
         return Trigger.select(Trigger, Expression).join(Expression).join(VarSensor, JOIN_INNER).where(
             VarSensor.source == sensor)
 
+    @property
+    def current(self):
+        """The last value of this trigger, from the trigger state of the core when available
+        """
+        if Trigger.state is not None:
+            value = Trigger.state.get(self.id)
+            if value is not None:
+                return value
+        return self.lastvalue
+
     def add_value(self, value):
-        """Add a value to the trigger
+        """Add a value to the trigger, the value is written by the trigger state of the core when available
 
         :param value: The value to add to this :class:`Trigger`
         """
         self.lastvalue = value
+        if Trigger.state is not None:
+            Trigger.state.set(self, value)
+            return
         self.save()
         if self.record:
-            value = TriggerValue.create(trigger=self, value=value)
+            timestamp = datetime.datetime.now()
+            value = TriggerValue.partition(timestamp).create(trigger=self, numeric=value, timestamp=timestamp)
+
+    def depends_on(self, trigger):
+        """Check if this trigger depends directly or indirectly on another trigger.
+        A trigger using its own value does not depend on itself
+
+        :param trigger: The :class:`Trigger` to look for, pass this trigger to check for a dependency cycle
+        :rtype: True if this trigger depends on the trigger
+        """
+        target = int(trigger.id if isinstance(trigger, Trigger) else trigger)
+        seen = {self.id}
+        stack = [(self.id, self._data['expression'])]
+        while stack:
+            current, expression = stack.pop()
+            sources = VarTrigger.select(VarTrigger.source, Trigger.expression).join(Trigger).where(
+                VarTrigger.expression == expression).tuples()
+            for source, sourceexpression in sources:
+                if source == current:
+                    continue
+                if source == target:
+                    return True
+                if source not in seen:
+                    seen.add(source)
+                    stack.append((source, sourceexpression))
+        return False
 
     def lastrecords(self, num):
         rtn = 0
-        if self.lastvalue:
+        if self.current is not None:
             if self.record:
-                rtn = TriggerValue.select().where(TriggerValue.trigger == self).order_by(
-                    TriggerValue.timestamp.desc()).limit(num).naive()
+                rtn = Trigger.state.pending(self.id)[:num] if Trigger.state is not None else []
+                for table in TriggerValue.tables():
+                    if len(rtn) >= num:
+                        break
+                    rtn.extend(table.select().where(table.trigger == self).order_by(
+                        table.timestamp.desc()).limit(num - len(rtn)).naive())
             else:
-                rtn = self.lastvalue
+                rtn = self.current
         return rtn
 
+    def window(self, aggregate, since):
+        """Returns an aggregate of the values of this trigger since a point in time,
+        calculated by the database including the values not yet written by the trigger state.
+        Returns the last value if the trigger is not recorded
 
-class TriggerValue(BaseModel):
+        :param aggregate: The SQL aggregate function, ie: fn.AVG
+        :param since: Only values after this time are used
+        """
+        if not self.record:
+            return 0 if self.current is None else self.current
+        stats = []
+        if Trigger.state is not None:
+            values = [record.numeric for record in Trigger.state.pending(self.id) if record.timestamp > since]
+            if values:
+                stats.append((len(values), math.fsum(values), min(values), max(values)))
+        result = TriggerValue.aggregate(aggregate, lambda table: table.trigger == self, since, stats)
+        return 0 if result is None else result
+
+
+class TriggerValue(PartitionedModel):
     """values of triggers
 
     * trigger: :class:`Trigger` to which this value belongs
-    * value: The actual value
+    * value: Text value, only used by values stored before triggers values were numeric
+    * numeric: The actual value
     * timestamp: Time at which this value was calculated
     """
     translations = [('value', 'value'),
+                    ('numeric', 'numeric'),
                     ('timestamp', 'timestamp')]
     trigger = ForeignKeyField(Trigger, related_name='values', on_delete='CASCADE')
-    value = CharField()
+    value = CharField(null=True)
+    numeric = DoubleField(null=True)
     timestamp = DateTimeField(default=datetime.datetime.now)
 
-    class meta:
-        order_by = ('-Timestamp',)
+    class Meta:
         indexes = (
-            (('Trigger', 'Timestamp'), True)
+            (('trigger', 'timestamp', 'numeric'), False),
         )
 
+    @property
+    def reading(self):
+        """The value of this record
+        """
+        if self.numeric is None:
+            return self.value
+        return self.numeric
+
 
 class VarSensor(BaseModel):
     """Mapping of :class:`Sensor` used by :class:`Expression`
@@ -490,6 +895,11 @@ class VarSensor(BaseModel):
     * expression: :class:`Expression` using this sensor
     * function: Which function to use on the values of this sensor
     * args: Tuple of arguments for the sensor function
+
+    .. note::
+
+        The time window functions tavg, tmin, tmax, tsum and tcount take a duration
+        as argument, ie: 600, 10m, 2h or 1d
     """
     translations = [('function', 'function'),
                     ('args', 'args')]
@@ -514,6 +924,24 @@ class VarTrigger(BaseModel):
     function = CharField()
     args = CharField()
 
+    @classmethod
+    def add(cls, source, expression, function, args):
+        """Add a trigger to an expression. Raises a :class:`cycleerror` if a
+        trigger using the expression would depend on itself, nothing is added then
+
+        :param source: The :class:`Trigger` to use
+        :param expression: The :class:`Expression` using the trigger
+        :param function: Which function to use on the values of the trigger
+        :param args: Arguments of the function
+        :rtype: The new :class:`VarTrigger`
+        """
+        with dbconn.transaction():
+            vartrigger = cls.create(source=source, expression=expression, function=function, args=args)
+            for trigger in Trigger.select().where(Trigger.expression == expression):
+                if trigger.depends_on(trigger):
+                    raise cycleerror(trigger, "Trigger {} would depend on itself".format(trigger.id))
+        return vartrigger
+
 
 class Action(BaseModel):
     """Actions to send to a module
@@ -548,6 +976,13 @@ class ActionArg(BaseModel):
         else:
             return key, value
 
+    @classmethod
+    def get_by_action(cls, action):
+        """Returns the arguments of an :class:`Action` together with their :class:`RPCArg` and :class:`Expression`
+        """
+        return cls.select(cls, RPCArg, Expression).join(RPCArg).switch(cls).join(Expression).where(
+            cls.action == action)
+
     @classmethod
     def get_dict(cls, action, calculator):
         """This function creates a dict from the arguments of a :class:`Action`
@@ -558,9 +993,8 @@ class ActionArg(BaseModel):
         :param sensor: The :class:`Action` to retrieve the argument dictionary for
         :rtype: A dict with argument keys and values
         """
-        actionargs = cls.select().where(cls.action == action)
         kwargs = {}
-        for act in actionargs:
+        for act in cls.get_by_action(action):
             value = calculator.resolve(act.value)
             rpcarg = act.rpcarg
             key, value = cls._to_dict(kwargs, rpcarg.name, value)
@@ -584,7 +1018,8 @@ class TriggerAction(BaseModel):
 
     @classmethod
     def get_by_trigger(cls, trigger):
-        return cls.select(cls, Action).join(Action).where(cls.trigger == trigger)
+        return cls.select(cls, Action, ModuleRPC, Module, Expression).join(Action).join(ModuleRPC).join(
+            Module).switch(cls).join(Expression).where(cls.trigger == trigger)
 
 
 class dbhandler:
@@ -597,12 +1032,21 @@ class dbhandler:
                    to the database driver
        :param database: Database object to use. It should be a peewee-usable database object
     """
+    # database objects by configuration, all handlers with the same configuration share a connection pool
+    databases = {}
 
     def __init__(self, conf=None, database=None):
         self.connected = False
         if database:
             self.databaseconn = database
         elif conf:
+            key = tuple(sorted(conf.items()))
+            partitioned = conf.pop('partitioned', False)
+            storage = conf.pop('storage', 'sql')
+            storagepath = conf.pop('storage_path', 'values')
+            pool = {'max_connections': conf.pop('max_connections', 0),
+                    'stale_timeout': conf.pop('stale_timeout', None),
+                    'timeout': conf.pop('pool_timeout', None)}
             try:
                 driver = conf.pop('driver')
             except:
@@ -612,46 +1056,163 @@ class dbhandler:
             except:
                 raise ImproperlyConfigured("No database found in config")
             else:
-                databaseconn = None
-                if driver == 'mysql':
-                    databaseconn = MySQLDatabase(database, threadlocals=True, **conf)
-                elif driver == 'postgres':
-                    databaseconn = PostgresqlDatabase(database, threadlocals=True, **conf)
-                elif driver == 'sqlite':
-                    databaseconn = SqliteDatabase(database, threadlocals=True, **conf)
-                else:
-                    raise ImproperlyConfigured(
-                        "Cannot use database driver {}, only mysql, postgres and sqlite are supported".format(driver))
-                if databaseconn:
-                    dbconn.initialize(databaseconn)
-                else:
-                    raise ImproperlyConfigured("Cannot not initialize database connection")
+                databaseconn = self.databases.get(key)
+                if databaseconn is None:
+                    databaseconn = self._database(driver, database, conf, pool)
+                    for table in self.partitioned:
+                        table.partitions = partitions.layout(table, databaseconn) if partitioned else None
+                    if storage == 'columns':
+                        SensorValue.store = columnstore.columnstore(storagepath)
+                    elif storage == 'sql':
+                        SensorValue.store = None
+                    else:
+                        raise ImproperlyConfigured(
+                            "Cannot use storage {}, only sql and columns are supported".format(storage))
+                    self.databases[key] = databaseconn
+                dbconn.initialize(databaseconn)
+
+    @staticmethod
+    def _database(driver, database, conf, pool):
+        """Returns a new peewee database object, a connection pool if max_connections is set.
+        Connections idle for longer than stale_timeout seconds are closed, connect waits
+        up to pool_timeout seconds for a free connection
+        """
+        if pool['max_connections']:
+            drivers = {'mysql': playhouse.pool.PooledMySQLDatabase,
+                       'postgres': playhouse.pool.PooledPostgresqlDatabase,
+                       'sqlite': playhouse.pool.PooledSqliteDatabase}
+            conf = dict(conf, **pool)
+            if driver == 'sqlite':
+                # pooled connections are handed to other threads
+                conf['check_same_thread'] = False
+        else:
+            drivers = {'mysql': MySQLDatabase,
+                       'postgres': PostgresqlDatabase,
+                       'sqlite': SqliteDatabase}
+        if driver not in drivers:
+            raise ImproperlyConfigured(
+                "Cannot use database driver {}, only mysql, postgres and sqlite are supported".format(driver))
+        conf = {name: value for name, value in conf.items() if value is not None}
+        return drivers[driver](database, threadlocals=True, **conf)
+
+    tables = [Module,
+              RPCType,
+              ModuleRPC,
+              RPCArg,
+              Expression,
+              Sensor,
+              SensorValue,
+              SensorRollupMinute,
+              SensorRollupHour,
+              SensorRollupDay,
+              SensorArg,
+              Action,
+              Trigger,
+              TriggerValue,
+              VarSensor,
+              VarTrigger,
+              TriggerAction,
+              ActionArg]
+    partitioned = [SensorValue, TriggerValue]
 
     def create_tables(self):
         """Try to create a set of empty tables, silently fails if the table already exists
         """
-        tables = [Module,
-                  RPCType,
-                  ModuleRPC,
-                  RPCArg,
-                  Expression,
-                  Sensor,
-                  SensorValue,
-                  SensorArg,
-                  Action,
-                  Trigger,
-                  TriggerValue,
-                  VarSensor,
-                  VarTrigger,
-                  TriggerAction,
-                  ActionArg]
-
-        for table in tables:
-            try:
+        for table in self.tables:
+            if table in self.partitioned and table.partitions is not None:
+                table.partitions.create()
+            elif not table.table_exists():
                 table.create_table()
                 print("created table:", table)
-            except InternalError:
-                pass
+
+    def _migrator(self):
+        database = dbconn.obj
+        if isinstance(database, MySQLDatabase):
+            return playhouse.migrate.MySQLMigrator(database)
+        elif isinstance(database, PostgresqlDatabase):
+            return playhouse.migrate.PostgresqlMigrator(database)
+        else:
+            return playhouse.migrate.SqliteMigrator(database)
+
+    def _castnumeric(self, field):
+        """Returns a SQL expression converting a text field to a number and a condition
+        selecting the values that can be converted
+        """
+        database = dbconn.obj
+        pattern = '^ *[-+]?[0-9]*[.]?[0-9]+([eE][-+]?[0-9]+)? *$'
+        if isinstance(database, MySQLDatabase):
+            return (fn.CAST(Clause(field, SQL('AS DECIMAL(65,30)'))),
+                    field.regexp(pattern))
+        elif isinstance(database, PostgresqlDatabase):
+            return (fn.CAST(Clause(field, SQL('AS DOUBLE PRECISION'))),
+                    field.regexp(pattern))
+        else:
+            # like is compiled to GLOB by the sqlite database
+            return (fn.CAST(Clause(field, SQL('AS REAL'))),
+                    (field % '*[0-9]*') & ~(field % '*[^0-9.eE+ -]*'))
+
+    def _migrate_numeric(self, changes):
+        """Move the values of numeric sensors and of triggers from the text column to the numeric column,
+        partitioned tables are skipped
+        """
+        if SensorValue.partitions is None:
+            cast, convertible = self._castnumeric(SensorValue.value)
+            numeric = Sensor.select(Sensor.id).where(Sensor.numeric == True)
+            with dbconn.transaction():
+                converted = SensorValue.update(numeric=cast, value=None).where(
+                    SensorValue.numeric.is_null() & (SensorValue.sensor << numeric) & convertible).execute()
+            if converted:
+                changes.append("converted {} sensor values to numeric".format(converted))
+        if TriggerValue.partitions is None:
+            cast, convertible = self._castnumeric(TriggerValue.value)
+            with dbconn.transaction():
+                converted = TriggerValue.update(numeric=cast, value=None).where(
+                    TriggerValue.numeric.is_null() & convertible).execute()
+            if converted:
+                changes.append("converted {} trigger values to numeric".format(converted))
+
+    def migrate(self):
+        """Bring the tables of an existing database up to date. Adds missing columns and indexes
+        and converts the value columns that changed to numeric columns. Partitioned value tables are skipped
+
+        :rtype: A list with a description of the applied changes
+        """
+        migrator = self._migrator()
+        operations = []
+        changes = []
+        trigger = Trigger._meta.db_table
+        for column in dbconn.get_columns(trigger):
+            if column.name == Trigger.lastvalue.db_column and 'char' in column.data_type.lower():
+                # the last value is recalculated on the next change of the trigger
+                with dbconn.transaction():
+                    playhouse.migrate.migrate(migrator.drop_column(trigger, column.name))
+                changes.append("dropped text column {}.{}".format(trigger, column.name))
+        for table in self.tables:
+            name = table._meta.db_table
+            if table in self.partitioned and table.partitions is not None:
+                # partitioned tables and their partitions are created with the current columns
+                changes.append("skipped partitioned table {}".format(name))
+                continue
+            columns = {column.name: column for column in dbconn.get_columns(name)}
+            for field in table._meta.sorted_fields:
+                if field.db_column not in columns:
+                    operations.append(migrator.add_column(name, field.db_column, field))
+                    changes.append("added column {}.{}".format(name, field.db_column))
+                elif field.null and not columns[field.db_column].null:
+                    # the text value of a numeric value is empty
+                    operations.append(migrator.drop_not_null(name, field.db_column))
+                    changes.append("dropped not null of column {}.{}".format(name, field.db_column))
+            indexes = {tuple(index.columns) for index in dbconn.get_indexes(name)}
+            for fields, unique in table._meta.indexes:
+                indexcolumns = tuple(table._meta.fields[field].db_column for field in fields)
+                if indexcolumns not in indexes:
+                    operations.append(migrator.add_index(name, indexcolumns, unique))
+                    changes.append("added index on {}({})".format(name, ', '.join(indexcolumns)))
+        with dbconn.transaction():
+            playhouse.migrate.migrate(*operations)
+        # also converts the values of sensors that were made numeric since the last migration
+        self._migrate_numeric(changes)
+        return changes
 
     def init_tables(self):
         """Initialize any preconfigured content that is needed for initial
@@ -684,25 +1245,80 @@ class dbhandler:
 
 
 class ops:
+    """Sensor and trigger functions used in expressions. Sensor values are
+    taken from the ring buffers of the core when available, see :class:`domos.util.ringbuffer.bufferstore`
+    """
+    buffers = None
+    windows = {'tavg': fn.AVG,
+               'tmin': fn.MIN,
+               'tmax': fn.MAX,
+               'tsum': fn.SUM,
+               'tcount': fn.COUNT}
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
     def __init__(self):
         pass
 
     @staticmethod
     def operation(function):
+        if function.function in ops.windows:
+            return ops.window(function.source, function.function, function.args)
+        if ops.buffers is not None and isinstance(function, VarSensor):
+            result = ops.buffered(function)
+            if result is not None:
+                return result
         op = {'last': ops.last,
               'avg': ops.avg,
               'sum': ops.sumation,
               'diff': ops.diff,
               'tdiff': ops.tdiff,
         }[function.function]
-        print('looking up value with')
         return op(function.source, function.args)
 
+    @staticmethod
+    def buffered(function):
+        """Calculate a sensor function from the ring buffer of the sensor,
+        returns None if the sensor is not buffered or the buffer is too small
+        """
+        buffer = ops.buffers.get(function._data['source'])
+        if buffer is None:
+            return None
+        if function.function in ('diff', 'tdiff'):
+            num = 2
+        else:
+            num = int(function.args)
+        if num > buffer.size:
+            return None
+        return {'last': lambda: buffer.last(num),
+                'avg': lambda: buffer.avg(num),
+                'sum': lambda: buffer.sum(num),
+                'diff': buffer.diff,
+                'tdiff': buffer.tdiff,
+        }[function.function]()
+
+    @staticmethod
+    def duration(args):
+        """Returns the timedelta of a duration argument, a number of seconds
+        or a number followed by a unit: s, m, h or d
+        """
+        args = args.strip()
+        if args[-1:] in ops.units:
+            return datetime.timedelta(seconds=float(args[:-1]) * ops.units[args[-1]])
+        return datetime.timedelta(seconds=float(args))
+
+    @staticmethod
+    def window(source, function, args):
+        since = datetime.datetime.now() - ops.duration(args)
+        return source.window(ops.windows[function], since)
+
     @staticmethod
     def last(source, num):
-        last = source.lastrecords(int(num))
-        if last:
-            return last.select().offset(num).dicts().get()['value']
+        num = int(num)
+        last = source.lastrecords(num)
+        if isinstance(last, (str, float)):
+            return last
+        elif last and len(last) >= num > 0:
+            return last[num - 1].reading
         else:
             return 0
 
@@ -710,7 +1326,7 @@ class ops:
     def sumation(source, num):
         selection = source.lastrecords(int(num))
         if selection:
-            result = math.fsum((int(i.Value) for i in selection))
+            result = math.fsum((i.reading for i in selection))
             return result
         else:
             return 0
@@ -718,8 +1334,8 @@ class ops:
     @staticmethod
     def avg(source, num):
         selection = source.lastrecords(int(num))
-        if last:
-            result = statistics.mean((int(i.Value) for i in selection))
+        if selection:
+            result = statistics.mean((i.reading for i in selection))
             return result
         else:
             return 0
@@ -727,10 +1343,10 @@ class ops:
     @staticmethod
     def diff(source, args):
         selection = source.lastrecords(2)
-        if selection:
+        if selection and len(selection) == 2:
             try:
-                result1 = float(selection[0].Value)
-                result2 = float(selection[1].Value)
+                result1 = float(selection[0].reading)
+                result2 = float(selection[1].reading)
             except:
                 raise sensorerror(source, 'could not convert values to floating point numbers')
             result = result1 - result2
@@ -741,11 +1357,12 @@ class ops:
     @staticmethod
     def tdiff(source, args):
         selection = source.lastrecords(2)
-        if selection:
+        if selection and len(selection) == 2:
             result1 = selection[0]
             result2 = selection[1]
-            print(type(result1.Timestamp))
-            result = (int(result1.value) - int(result2.value)) / (result1.timestamp - result2.timestamp).total_seconds()
+            seconds = (result1.timestamp - result2.timestamp).total_seconds()
+            # values measured at the same time have no rate
+            result = (result1.reading - result2.reading) / seconds if seconds else 0
         else:
             result = 0
         return result
@@ -755,3 +1372,9 @@ class sensorerror(Exception):
     def __init__(self, sensor, message):
         self.sensor = sensor
         self.message = message
+
+
+class cycleerror(Exception):
+    def __init__(self, trigger, message):
+        self.trigger = trigger
+        self.message = message
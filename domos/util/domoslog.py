@@ -4,7 +4,7 @@ import json
 from threading import Thread
 import domos.util.domossettings as ds
 from domos.util.domossettings import domosSettings
-from dashi import DashiConnection
+from domos.util.transport import gettransport
 import socket
 import sys
 from pprint import pprint
@@ -21,11 +21,8 @@ class rpclogger(Thread):
         self.done = False
         Thread.__init__(self)
         self.name = "log"
-        dashiconfig = domosSettings.getExchangeConfig()
         self.logcfg = domosSettings.getLoggingConfig()
-        self.dashi = DashiConnection(self.name, dashiconfig["amqp_uri"],
-                                     dashiconfig['exchange'],
-                                     sysname=dashiconfig['prefix'])
+        self.transport = gettransport(self.name, domosSettings.getExchangeConfig())
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger('Log')
         self.logchannels = []
@@ -37,13 +34,13 @@ class rpclogger(Thread):
             ch.setLevel(rpclogger.loglevel[level])
             ch.setFormatter(formatter)
             self.logger.addHandler(ch)
-        # register dashi handler functions
-        self.dashi.handle(self.logrecord, "logrecord")
+        # register handler functions
+        self.transport.handle(self.logrecord, "logrecord")
 
     def run(self):
         while not self.done:
             try:
-                self.dashi.consume(timeout=2)
+                self.transport.consume(timeout=2)
             except socket.timeout as ex:
                 pass
 
@@ -50,6 +50,12 @@ class domosSettings:
         cfg = {}
         for dictmap, configmap, default in configmapping:
             cfg[dictmap] = config.get(domosSettings.dbsection, configmap, fallback=default)
+        cfg['partitioned'] = config.getboolean(domosSettings.dbsection, 'partitioned', fallback=False)
+        cfg['storage'] = config.get(domosSettings.dbsection, 'storage', fallback='sql')
+        cfg['storage_path'] = config.get(domosSettings.dbsection, 'storage_path', fallback='values')
+        cfg['max_connections'] = config.getint(domosSettings.dbsection, 'max_connections', fallback=20)
+        cfg['stale_timeout'] = config.getint(domosSettings.dbsection, 'stale_timeout', fallback=300)
+        cfg['pool_timeout'] = config.getint(domosSettings.dbsection, 'pool_timeout', fallback=10)
         return cfg
 
     @staticmethod
@@ -68,7 +74,20 @@ class domosSettings:
     def get_core_config():
         config = domosSettings._readConfig()
         cfg = {}
-        cfg['module_dir'] = shlex.split(config.get(domosSettings.coresection, 'module_dir', fallback = None))
+        cfg['module_dir'] = shlex.split(config.get(domosSettings.coresection, 'module_dir', fallback=''))
+        cfg['cascade'] = config.getboolean(domosSettings.coresection, 'cascade', fallback=False)
+        cfg['writebuffer_size'] = config.getint(domosSettings.coresection, 'writebuffer_size', fallback=500)
+        cfg['writebuffer_interval'] = config.getint(domosSettings.coresection, 'writebuffer_interval', fallback=200)
+        cfg['writebuffer_max'] = config.getint(domosSettings.coresection, 'writebuffer_max', fallback=10000)
+        cfg['rollup_interval'] = config.getint(domosSettings.coresection, 'rollup_interval', fallback=60)
+        cfg['retention'] = config.getint(domosSettings.coresection, 'retention', fallback=0)
+        cfg['rollup_retention'] = config.getint(domosSettings.coresection, 'rollup_retention', fallback=0)
+        cfg['prune_interval'] = config.getint(domosSettings.coresection, 'prune_interval', fallback=3600)
+        cfg['prune_batch'] = config.getint(domosSettings.coresection, 'prune_batch', fallback=1000)
+        cfg['prune_pause'] = config.getint(domosSettings.coresection, 'prune_pause', fallback=100)
+        cfg['trigger_flush_interval'] = config.getint(domosSettings.coresection, 'trigger_flush_interval', fallback=1000)
+        cfg['action_workers'] = config.getint(domosSettings.coresection, 'action_workers', fallback=4)
+        cfg['action_inflight'] = config.getint(domosSettings.coresection, 'action_inflight', fallback=100)
         return cfg
 
     @staticmethod
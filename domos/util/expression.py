@@ -0,0 +1,78 @@
+import json
+import threading
+from plyplus import Grammar
+from plyplus.strees import STree
+
+GRAMMAR = """
+    start: lgc;             // This is the top of the hierarchy
+    ?lgc: ( lgc lgc_symbol )? eql;
+    ?eql: ( eql eql_symbol )? add;
+    ?add: ( add add_symbol )? mul;
+    ?mul: ( mul mul_symbol )? exp;
+    ?exp: ( exp exp_symbol )? atom;
+    @atom: neg | number | string | sensor | trigger | true_symbol | false_symbol | parenthesis;
+    parenthesis: popen_sym add pclose_sym;
+    neg: '-' atom;
+    true_symbol: 'True' | 'true' | 'Yes' | 'yes';
+    false_symbol: 'False' | 'false' | 'No' | 'no';
+    string: '[\"]\w+[\"]';
+    number: '[\d.]+';           // Regular expression for a decimal number
+    sensor: '__sens\d+__';      // Sensor database match
+    trigger: '__trig\d+__';     // trigger database match
+    macro: '__macr\d+__';       // macro database match
+    mul_symbol: '\*' | '/' | '//' | '%'; // Match * or / or %
+    add_symbol: '\+' | '-'; // Match + or -
+    exp_symbol: '\*\*';
+    eql_symbol: '==' | '<=' | '!=' | '>=' |'<' | '>';
+    lgc_symbol: '\|\|' | '\&\&';
+    bit_symbol: '\|' | '\&' | '\^';
+    popen_sym: '\(';
+    pclose_sym: '\)';
+    WHITESPACE: '[ \t]+' (%ignore);
+"""
+
+_grammar = None
+# the parser is not thread safe
+_lock = threading.Lock()
+
+
+def parse(expression):
+    """Returns the syntax tree of an expression string as nested lists,
+    a node is a list of the rule name followed by its children, tokens are strings
+
+    :param expression: The expression string
+    """
+    global _grammar
+    with _lock:
+        if _grammar is None:
+            _grammar = Grammar(GRAMMAR)
+        tree = _grammar.parse(expression)
+    return _nodes(tree)
+
+
+def _nodes(tree):
+    return [tree.head] + [_nodes(child) if isinstance(child, STree) else child for child in tree.tail]
+
+
+def dumps(expression, tree=None):
+    """Returns the serialized syntax tree of an expression string, as stored in the pickled column of an expression
+
+    :param expression: The expression string
+    :param tree: The syntax tree of the expression, parsed if not given
+    """
+    if tree is None:
+        tree = parse(expression)
+    return json.dumps({'expression': expression, 'tree': tree}, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """Returns the expression string and the syntax tree of a serialized expression,
+    None if the data is not a serialized syntax tree
+
+    :param data: Data serialized by :func:`dumps`
+    """
+    try:
+        stored = json.loads(bytes(data).decode('utf-8'))
+        return stored['expression'], stored['tree']
+    except (ValueError, TypeError, KeyError):
+        return None
@@ -0,0 +1,285 @@
+import datetime
+import re
+import threading
+from abc import ABC, abstractmethod
+from peewee import *
+from peewee import EnclosedClause, Entity
+
+
+def month(timestamp):
+    """Returns the start of the month containing the timestamp
+    """
+    return datetime.datetime(timestamp.year, timestamp.month, 1)
+
+
+def nextmonth(timestamp):
+    """Returns the start of the month after the month containing the timestamp
+    """
+    if timestamp.month == 12:
+        return datetime.datetime(timestamp.year + 1, 1, 1)
+    return datetime.datetime(timestamp.year, timestamp.month + 1, 1)
+
+
+def layout(model, database):
+    """Returns the partition layout of a value table for a database
+
+    :param model: The value model to partition, ie: SensorValue
+    :param database: The peewee database object
+    """
+    if isinstance(database, MySQLDatabase):
+        return mysqlpartitions(model)
+    elif isinstance(database, PostgresqlDatabase):
+        return postgrespartitions(model)
+    else:
+        return tablepartitions(model)
+
+
+class partitions(ABC):
+    """Monthly partitions of a value table, base of the database specific layouts.
+    Partitions are named after the table and the month, ie: sensorvalue_202001
+
+    :param model: The value model to partition
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.months = None
+        self.lock = threading.Lock()
+
+    def name(self, start):
+        return '{}_{:%Y%m}'.format(self.model._meta.db_table, start)
+
+    @abstractmethod
+    def _load(self):
+        """Returns the months of the existing partitions
+        """
+
+    @abstractmethod
+    def _add(self, start):
+        """Create the partition of a month
+        """
+
+    @abstractmethod
+    def _drop(self, start):
+        """Drop the partition of a month
+        """
+
+    def _months(self):
+        if self.months is None:
+            self.months = set(self._load())
+        return self.months
+
+    def create(self):
+        """Create the table and the partitions of the current and the next month
+        """
+        self.upcoming()
+
+    def upcoming(self):
+        """Create the partitions of the current and the next month. Partitions are
+        created ahead of time and never while writing values, adding a partition
+        commits the open transaction on MySQL
+        """
+        now = datetime.datetime.now()
+        self.ensure(now)
+        self.ensure(nextmonth(now))
+
+    def ensure(self, timestamp):
+        """Make sure the partition of the month of a timestamp exists
+        """
+        start = month(timestamp)
+        with self.lock:
+            months = self._months()
+            if start not in months:
+                self._add(start)
+                months.add(start)
+
+    def table(self, timestamp):
+        """Returns the model to insert a value of a point in time into, the database
+        routes the value to its partition
+        """
+        return self.model
+
+    def tables(self, start=None, end=None):
+        """Returns the models holding the values between start and end, newest first
+        """
+        return [self.model]
+
+    def drop(self, before):
+        """Drop the partitions of which all values are older than a point in time
+
+        :param before: a datetime object
+        :rtype: A list with the names of the dropped partitions
+        """
+        dropped = []
+        with self.lock:
+            months = self._months()
+            for start in sorted(months):
+                if nextmonth(start) > before:
+                    break
+                self._drop(start)
+                months.discard(start)
+                dropped.append(self.name(start))
+        return dropped
+
+
+class tablepartitions(partitions):
+    """Partitions stored as a table per month, used for sqlite. The unpartitioned
+    table is kept as the oldest partition for values stored before partitioning was enabled
+    """
+    # models of the partitions by table name, shared because a foreign key can only be declared once
+    models = {}
+
+    def _model(self, start):
+        name = self.name(start)
+        model = self.models.get(name)
+        if model is None:
+            attrs = {'Meta': type('Meta', (), {'db_table': name})}
+            for field in self.model._meta.declared_fields:
+                if isinstance(field, ForeignKeyField):
+                    attrs[field.name] = ForeignKeyField(field.rel_model, related_name=name,
+                                                        on_delete=field.on_delete)
+            model = type(name, (self.model,), attrs)
+            self.models[name] = model
+        return model
+
+    def _load(self):
+        pattern = re.compile(r'^{}_(\d{{4}})(\d{{2}})$'.format(re.escape(self.model._meta.db_table)))
+        for table in self.model._meta.database.get_tables():
+            match = pattern.match(table)
+            if match:
+                yield datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+
+    def _add(self, start):
+        self._model(start).create_table(fail_silently=True)
+
+    def _drop(self, start):
+        self._model(start).drop_table(fail_silently=True)
+
+    def create(self):
+        if not self.model.table_exists():
+            self.model.create_table()
+        partitions.create(self)
+
+    def table(self, timestamp):
+        # values of a month without a partition are stored in the unpartitioned table
+        start = month(timestamp)
+        with self.lock:
+            if start not in self._months():
+                return self.model
+        return self._model(start)
+
+    def tables(self, start=None, end=None):
+        with self.lock:
+            months = sorted(self._months(), reverse=True)
+        return [self._model(first) for first in months
+                if (end is None or first <= end) and (start is None or nextmonth(first) > start)] + [self.model]
+
+
+class rangepartitions(partitions):
+    """Native range partitioning by timestamp, the database routes queries to the partitions
+    """
+
+    @abstractmethod
+    def partitioning(self):
+        """Returns the partitioning clauses of the CREATE TABLE statement
+        """
+
+    def _columns(self):
+        """Returns the column definitions of the table, the primary key includes
+        the timestamp because the partitioning column has to be part of every unique key
+        """
+        compiler = self.model._meta.database.compiler()
+        meta = self.model._meta
+        columns = [SQL(self.primarykey.format(compiler.quote(meta.primary_key.db_column)))]
+        columns += [compiler.field_definition(field) for field in meta.declared_fields
+                    if field is not meta.primary_key]
+        columns.append(Clause(SQL('PRIMARY KEY'), EnclosedClause(meta.primary_key.as_entity(),
+                                                                 self.model.timestamp.as_entity())))
+        return columns
+
+    def _execute(self, *nodes):
+        database = self.model._meta.database
+        sql, params = database.compiler().parse_node(Clause(*nodes))
+        return database.execute_sql(sql, params)
+
+    def create(self):
+        if not self.model.table_exists():
+            self._execute(SQL('CREATE TABLE'), self.model.as_entity(),
+                          EnclosedClause(*self._columns()), *self.partitioning())
+            for fields, unique in self.model._meta.indexes:
+                self.model._meta.database.create_index(self.model, fields, unique)
+        partitions.create(self)
+
+
+class mysqlpartitions(rangepartitions):
+    """MySQL range partitioning, values newer than the last partition are stored
+    in a catch-all partition which is split when a partition is added. Partitioned
+    tables in MySQL do not support foreign keys
+    """
+    primarykey = '{} INTEGER NOT NULL AUTO_INCREMENT'
+
+    def partitioning(self):
+        return [SQL('PARTITION BY RANGE'), EnclosedClause(fn.TO_DAYS(self.model.timestamp.as_entity())),
+                EnclosedClause(SQL('PARTITION pfuture VALUES LESS THAN MAXVALUE'))]
+
+    def _load(self):
+        cursor = self.model._meta.database.execute_sql(
+            'SELECT PARTITION_NAME FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', (self.model._meta.db_table,))
+        for name, in cursor.fetchall():
+            if name and name != 'pfuture':
+                yield datetime.datetime.strptime(name[1:], '%Y%m')
+
+    def ensure(self, timestamp):
+        start = month(timestamp)
+        with self.lock:
+            months = self._months()
+            # values older than the last partition are stored in the first partition covering them
+            if start in months or (months and start < max(months)):
+                return
+            self._add(start)
+            months.add(start)
+
+    def _add(self, start):
+        self._execute(SQL('ALTER TABLE'), self.model.as_entity(), SQL('REORGANIZE PARTITION pfuture INTO'),
+                      EnclosedClause(
+                          Clause(SQL('PARTITION p{:%Y%m} VALUES LESS THAN'.format(start)),
+                                 EnclosedClause(fn.TO_DAYS(nextmonth(start).date()))),
+                          SQL('PARTITION pfuture VALUES LESS THAN MAXVALUE')))
+
+    def _drop(self, start):
+        self._execute(SQL('ALTER TABLE'), self.model.as_entity(), SQL('DROP PARTITION p{:%Y%m}'.format(start)))
+
+
+class postgrespartitions(rangepartitions):
+    """Postgres declarative partitioning, values outside the partitions are
+    stored in a default partition. Needs Postgres 11 or newer
+    """
+    primarykey = '{} SERIAL NOT NULL'
+
+    def partitioning(self):
+        return [SQL('PARTITION BY RANGE'), EnclosedClause(self.model.timestamp.as_entity())]
+
+    def create(self):
+        rangepartitions.create(self)
+        self._execute(SQL('CREATE TABLE IF NOT EXISTS'), Entity(self.model._meta.db_table + '_default'),
+                      SQL('PARTITION OF'), self.model.as_entity(), SQL('DEFAULT'))
+
+    def _load(self):
+        cursor = self.model._meta.database.execute_sql(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s', (self.model._meta.db_table,))
+        prefix = self.model._meta.db_table + '_'
+        for name, in cursor.fetchall():
+            if re.match(r'^\d{6}$', name[len(prefix):]):
+                yield datetime.datetime.strptime(name[len(prefix):], '%Y%m')
+
+    def _add(self, start):
+        self._execute(SQL('CREATE TABLE IF NOT EXISTS'), Entity(self.name(start)),
+                      SQL('PARTITION OF'), self.model.as_entity(),
+                      SQL('FOR VALUES FROM (%s) TO (%s)', start, nextmonth(start)))
+
+    def _drop(self, start):
+        self._execute(SQL('DROP TABLE IF EXISTS'), Entity(self.name(start)))
@@ -0,0 +1,156 @@
+import threading
+from domos.util.db import *
+
+
+class ringbuffer:
+    """Fixed size buffer with the last values of a sensor.
+    Keeps running sums so the sum and average of the last values are O(1)
+
+    :param size: Number of values to keep
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.timestamps = [None] * size
+        self.sums = [0.0] * (size + 1)
+        self.total = 0.0
+        self.appended = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.appended, self.size)
+
+    def append(self, value, timestamp):
+        """Add a value to the buffer, the oldest value is dropped when the buffer is full
+
+        :param value: The value to add, a number
+        :param timestamp: Time of the value
+        """
+        with self.lock:
+            self.values[self.appended % self.size] = value
+            self.timestamps[self.appended % self.size] = timestamp
+            self.total += value
+            self.appended += 1
+            self.sums[self.appended % (self.size + 1)] = self.total
+            if self.appended % self.size == 0:
+                # rebase the running sums to keep them from growing out of precision
+                base = self.sums[(self.appended - self.size) % (self.size + 1)]
+                self.sums = [running - base for running in self.sums]
+                self.total -= base
+
+    def _get(self, num):
+        index = (self.appended - num) % self.size
+        return self.values[index], self.timestamps[index]
+
+    def last(self, num=1):
+        """Returns the num-th last value, 1 is the latest value
+
+        :param num: Which value to return
+        """
+        with self.lock:
+            if 0 < num <= len(self):
+                return self._get(num)[0]
+            return 0
+
+    def sum(self, num):
+        """Returns the sum of the last num values
+
+        :param num: Number of values to sum
+        """
+        with self.lock:
+            num = min(num, len(self))
+            return self.total - self.sums[(self.appended - num) % (self.size + 1)]
+
+    def avg(self, num):
+        """Returns the average of the last num values
+
+        :param num: Number of values to average
+        """
+        with self.lock:
+            num = min(num, len(self))
+            if not num:
+                return 0
+            return (self.total - self.sums[(self.appended - num) % (self.size + 1)]) / num
+
+    def diff(self):
+        """Returns the difference between the last two values
+        """
+        with self.lock:
+            if len(self) < 2:
+                return 0
+            return self._get(1)[0] - self._get(2)[0]
+
+    def tdiff(self):
+        """Returns the difference between the last two values per second
+        """
+        with self.lock:
+            if len(self) < 2:
+                return 0
+            value1, timestamp1 = self._get(1)
+            value2, timestamp2 = self._get(2)
+            seconds = (timestamp1 - timestamp2).total_seconds()
+            return (value1 - value2) / seconds if seconds else 0
+
+
+class bufferstore:
+    """Ring buffers of all sensors used by sensor functions. The buffers are
+    sized to the largest window a :class:`VarSensor` requests for the sensor.
+    """
+    windows = {'last': lambda args: int(args),
+               'avg': lambda args: int(args),
+               'sum': lambda args: int(args),
+               'diff': lambda args: 2,
+               'tdiff': lambda args: 2}
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, sensor):
+        """Returns the buffer of a sensor or None if the sensor is not buffered
+
+        :param sensor: ID of the sensor
+        """
+        return self.buffers.get(int(sensor))
+
+    def append(self, sensor, value, timestamp):
+        """Add a value to the buffer of a sensor, non numeric values are ignored
+
+        :param sensor: ID of the sensor
+        :param value: The new value of the sensor
+        :param timestamp: Time of the value
+        """
+        buffer = self.buffers.get(int(sensor))
+        if buffer is not None:
+            try:
+                buffer.append(float(value), timestamp)
+            except (TypeError, ValueError):
+                pass
+
+    def warm(self):
+        """Create the buffers for all sensors used in sensor functions and fill
+        them with the last values from the database
+        """
+        sizes = {}
+        functions = VarSensor.select(VarSensor.source, VarSensor.function, VarSensor.args).tuples()
+        for sensor, function, args in functions:
+            try:
+                size = self.windows[function](args)
+            except (KeyError, ValueError):
+                continue
+            sizes[sensor] = max(size, sizes.get(sensor, 1))
+        buffers = {}
+        if not sizes:
+            self.buffers = buffers
+            return
+        for sensor in Sensor.select().where(Sensor.id << list(sizes)):
+            if sensor.instant:
+                continue
+            buffer = ringbuffer(sizes[sensor.id])
+            for record in reversed(list(sensor.lastrecords(buffer.size))):
+                try:
+                    buffer.append(float(record.reading), record.timestamp)
+                except (TypeError, ValueError):
+                    pass
+            buffers[sensor.id] = buffer
+        self.buffers = buffers
@@ -1,7 +1,38 @@
-from dashi import DashiConnection
 import domos.util.domossettings as ds
 from domos.util.domossettings import domosSettings
+from domos.util.transport import gettransport
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import logging
 import socket
+import threading
+import time
+import uuid
+
+
+class rpcerror(Exception):
+    """Error raised by the handler of a call made with :class:`asyncrpc`
+    """
+
+
+def replying(send, func):
+    """Wraps a handler function so it also answers the calls of :class:`asyncrpc`.
+    These calls are fire messages with the queue to send the reply to and a correlation id
+
+    :param send: Function to send the reply with, the fire method of a transport
+    :param func: The handler function
+    """
+    @functools.wraps(func)
+    def handler(_reply=None, _correlation=None, **kwargs):
+        if _reply is None:
+            return func(**kwargs)
+        try:
+            result, error = func(**kwargs), None
+        except Exception as err:
+            result, error = None, '{}: {}'.format(type(err).__name__, err)
+        send(_reply, '_reply', correlation=_correlation, result=result, error=error)
+    return handler
 
 
 class rpc:
@@ -11,18 +42,16 @@ class rpc:
             self.loghandle = loghandle
         else:
             self.loghandle = name
-        dashiconfig = domosSettings.getExchangeConfig()
-        self.dashi = DashiConnection(self.name, dashiconfig["amqp_uri"], dashiconfig['exchange'],
-                                     sysname=dashiconfig['prefix'])
+        self.transport = gettransport(self.name, domosSettings.getExchangeConfig())
 
     def handle(self, func, handle):
-        self.dashi.handle(func, handle)
+        self.transport.handle(replying(self.transport.fire, func), handle)
 
     def fire(self, target, func, **kwargs):
-        self.dashi.fire(target, func, **kwargs)
+        self.transport.fire(target, func, **kwargs)
 
     def call(self, target, func, **kwargs):
-        return self.dashi.call(target, func, **kwargs)
+        return self.transport.call(target, func, **kwargs)
 
     def logmsg(self, lvl, msg):
         call = 'log_{}'.format(lvl)
@@ -45,6 +74,198 @@ class rpc:
 
     def listen(self, timeout=2):
         try:
-            self.dashi.consume(timeout=timeout)
+            self.transport.consume(timeout=timeout)
         except socket.timeout as ex:
             pass
+
+
+class sensorbatch:
+    """Collects sensor values and sends them to the core as a single sensorValues message.
+    A batch is sent when it is full or when the delay after its first value has passed.
+    The batches are sent by a thread of the batch with its own connection, named after
+    the queue of the rpc object, so the connection of the module is never used by two threads
+
+    :param rpc: The rpc object of the module
+    :param delay: Milliseconds to wait for more values, read from the exchange config if not given
+    :param size: Maximum number of values in a batch, read from the exchange config if not given
+    """
+
+    def __init__(self, rpc, delay=None, size=None):
+        dashiconfig = domosSettings.getExchangeConfig()
+        self.name = '{}-values'.format(rpc.name)
+        self.delay = (delay if delay is not None else int(dashiconfig.get('batch_delay', 10))) / 1000
+        self.size = size if size is not None else int(dashiconfig.get('batch_size', 100))
+        self.values = []
+        self.unsent = 0
+        self.flushing = False
+        self.thread = None
+        self.condition = threading.Condition()
+        self.logger = logging.getLogger('SensorBatch')
+
+    def put(self, key, value, timestamp=None):
+        """Add a sensor value to the batch
+
+        :param key: key of the sensor
+        :param value: the value
+        :param timestamp: Time the value was measured in seconds since the epoch, now if not given
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.condition:
+            self.values.append([key, value, timestamp])
+            self.unsent += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._send, name=self.name, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def flush(self, timeout=5):
+        """Send the collected values now, returns False if they were not sent within timeout seconds
+        """
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+            sent = self.condition.wait_for(lambda: not self.unsent, timeout)
+            self.flushing = bool(self.values)
+            return sent
+
+    def _send(self):
+        sender = rpc(self.name)
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.values)
+                deadline = time.monotonic() + self.delay
+                self.condition.wait_for(lambda: len(self.values) >= self.size or self.flushing,
+                                        max(0, deadline - time.monotonic()))
+                values, self.values = self.values[:self.size], self.values[self.size:]
+                if not self.values:
+                    self.flushing = False
+            try:
+                sender.fire('domoscore', 'sensorValues', values=values)
+            except Exception as err:
+                self.logger.error("Could not send {} sensor values: {}".format(len(values), err))
+            with self.condition:
+                self.unsent -= len(values)
+                self.condition.notify_all()
+
+
+class asyncrpc:
+    """RPC for asyncio code. Many calls can wait for their reply at the same time:
+    a call is sent as a fire message with a correlation id and the handler of the
+    target fires the reply back to the reply queue of the caller. Incoming messages
+    and replies are consumed by their own IO threads, outgoing messages are sent by
+    a single sender thread, so each transport connection is only used by one thread
+
+    :param name: Name of the queue to consume
+    :param loghandle: Name to log with, the name of the queue if not given
+    """
+
+    def __init__(self, name, loghandle=None):
+        self.name = name
+        self.loghandle = loghandle or name
+        dashiconfig = domosSettings.getExchangeConfig()
+        self.transport = gettransport(self.name, dashiconfig)
+        self.sender = gettransport(self.name, dashiconfig)
+        # replies arrive while the IO thread waits for a coroutine handler
+        self.replies = gettransport('{}-reply'.format(self.name), dashiconfig)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+        self.loop = None
+        self.threads = []
+        self.done = threading.Event()
+        self.replies.handle(self._reply, '_reply')
+
+    def _send(self, target, func, **kwargs):
+        return self.executor.submit(self.sender.fire, target, func, **kwargs)
+
+    def _reply(self, correlation=None, result=None, error=None):
+        future = self.pending.pop(correlation, None)
+        if future is not None:
+            self.loop.call_soon_threadsafe(self._resolve, future, result, error)
+
+    @staticmethod
+    def _resolve(future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(rpcerror(error))
+        else:
+            future.set_result(result)
+
+    def handle(self, func, handle):
+        """Register a handler, a function or a coroutine function. Functions run
+        in the IO thread, coroutines run in the event loop. The result of a coroutine
+        is sent back to calls of an asyncrpc object when it is done, for other messages
+        the IO thread waits for the coroutine and returns its result or raises its error
+
+        :param func: The handler
+        :param handle: Name of the operation
+        """
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            def handler(_reply=None, _correlation=None, **kwargs):
+                future = asyncio.run_coroutine_threadsafe(func(**kwargs), self.loop)
+                if _reply is None:
+                    return future.result()
+                future.add_done_callback(functools.partial(self._answer, _reply, _correlation))
+            self.transport.handle(handler, handle)
+        else:
+            self.transport.handle(replying(self._send, func), handle)
+
+    def _answer(self, reply, correlation, future):
+        try:
+            result, error = future.result(), None
+        except Exception as err:
+            result, error = None, '{}: {}'.format(type(err).__name__, err)
+        self._send(reply, '_reply', correlation=correlation, result=result, error=error)
+
+    async def fire(self, target, func, **kwargs):
+        """Send a message without waiting for a reply
+        """
+        await asyncio.wrap_future(self._send(target, func, **kwargs))
+
+    async def call(self, target, func, timeout=5, **kwargs):
+        """Send a message and wait for the reply, raises socket.timeout if
+        there is no reply within timeout seconds and rpcerror if the handler failed
+        """
+        if self.loop is None:
+            raise RuntimeError('asyncrpc {} can not receive replies before start()'.format(self.name))
+        correlation = uuid.uuid4().hex
+        future = self.loop.create_future()
+        self.pending[correlation] = future
+        try:
+            await self.fire(target, func, _reply=self.replies.name, _correlation=correlation, **kwargs)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout('no reply to {} from {}'.format(func, target))
+        finally:
+            self.pending.pop(correlation, None)
+
+    async def logmsg(self, lvl, msg):
+        await self.fire('log', 'log_{}'.format(lvl), msg=msg, handle=self.loghandle)
+
+    def _listen(self, transport):
+        while not self.done.is_set():
+            try:
+                transport.consume(timeout=2)
+            except socket.timeout:
+                pass
+
+    def start(self, loop=None):
+        """Start consuming messages, handlers and replies run in the given event loop,
+        or in the running loop when called from a coroutine
+        """
+        self.loop = loop or asyncio.get_running_loop()
+        for transport in (self.transport, self.replies):
+            thread = threading.Thread(target=self._listen, args=(transport,), name='{}-io'.format(transport.name),
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def end(self):
+        """Stop consuming messages, waiting calls are cancelled
+        """
+        self.done.set()
+        for future in list(self.pending.values()):
+            self.loop.call_soon_threadsafe(future.cancel)
+        self.executor.shutdown(wait=False)
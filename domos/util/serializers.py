@@ -0,0 +1,54 @@
+import json
+import struct
+
+header = struct.Struct('<I')
+reading = struct.Struct('<qdd')
+
+STRUCT_CONTENT_TYPE = 'application/x-domos-struct'
+
+
+def _packable(body):
+    """Returns the values of a sensorValues message if all of them fit a record, else None
+    """
+    if not isinstance(body, dict) or body.get('op') != 'sensorValues' or not isinstance(body.get('args'), dict):
+        return None
+    values = body['args'].get('values')
+    if isinstance(values, list) and all(
+            isinstance(item, (list, tuple)) and len(item) == 3 and
+            isinstance(item[0], int) and not isinstance(item[0], bool) and
+            isinstance(item[1], float) and isinstance(item[2], float) for item in values):
+        return values
+    return None
+
+
+def dumps(body):
+    """Encode a message body. The values of a sensorValues message are packed as
+    fixed size (key, value, timestamp) records, all other messages are encoded as json.
+    Values with a non integer key, a non float value or no timestamp keep the message in json
+    """
+    values = _packable(body)
+    if values is None:
+        return b'J' + json.dumps(body).encode('utf-8')
+    encoded = json.dumps(dict(body, args=dict(body['args'], values=None))).encode('utf-8')
+    return b''.join([b'S', header.pack(len(encoded)), encoded] + [reading.pack(*item) for item in values])
+
+
+def loads(data):
+    """Decode a message body encoded by :func:`dumps`
+    """
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    if data[:1] == b'S':
+        length, = header.unpack_from(data, 1)
+        start = 1 + header.size
+        body = json.loads(data[start:start + length].decode('utf-8'))
+        body['args']['values'] = [list(item) for item in reading.iter_unpack(data[start + length:])]
+        return body
+    return json.loads(data[1:].decode('utf-8'))
+
+
+def register():
+    """Register the struct serializer with kombu
+    """
+    from kombu.serialization import register as komburegister
+    komburegister('struct', dumps, loads, content_type=STRUCT_CONTENT_TYPE, content_encoding='binary')
@@ -0,0 +1,228 @@
+import functools
+import logging
+import os
+import queue as qu
+import socket
+import threading
+from abc import ABC, abstractmethod
+
+
+def gettransport(name, config):
+    """Returns the transport of a queue, the backend is selected with the
+    transport option of the exchange config: dashi (default) or local, which
+    keeps the messages between the queues of a process in memory
+
+    :param name: Name of the queue to consume
+    :param config: The exchange config
+    """
+    kind = config.get('transport', 'dashi')
+    try:
+        backend = transports[kind]
+    except KeyError:
+        raise ValueError('Unknown transport: {}'.format(kind))
+    return backend(name, config)
+
+
+class transport(ABC):
+    """Base of the message transports. A transport consumes a named queue and
+    passes the messages to the handler functions registered for them
+
+    :param name: Name of the queue to consume
+    :param config: The exchange config
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+
+    @abstractmethod
+    def handle(self, func, name):
+        """Register a handler function for the messages of an operation
+        """
+
+    @abstractmethod
+    def fire(self, target, func, **kwargs):
+        """Send a message to a queue without waiting for a reply
+        """
+
+    @abstractmethod
+    def call(self, target, func, timeout=5, **kwargs):
+        """Send a message to a queue and return the reply of its handler,
+        raises socket.timeout if there is no reply within timeout seconds
+        """
+
+    @abstractmethod
+    def consume(self, timeout=None):
+        """Handle the incoming messages until none arrives for timeout seconds, then raises socket.timeout
+        """
+
+
+class dashitransport(transport):
+    """Transport over an AMQP broker using dashi. Messages are encoded with the
+    serializer option of the exchange config, the serializers option overrides it
+    for messages to specific queues as a list of queue:serializer pairs. The
+    serializer is sent along with each message, so a consumer decodes every message it receives.
+    Every other serializer opens another connection, ie: serializers = domoscore:struct
+    packs the sensor values sent to the core with a second connection
+    """
+
+    def __init__(self, name, config):
+        from dashi import DashiConnection
+        import domos.util.serializers as serializers
+        transport.__init__(self, name, config)
+        serializers.register()
+        self.connection = functools.partial(DashiConnection, name, config['amqp_uri'], config['exchange'],
+                                            sysname=config['prefix'])
+        self.serializer = config.get('serializer', 'json')
+        self.serializers = dict(item.split(':', 1) for item in config.get('serializers', '').split())
+        self.dashi = self.connection(serializer=self.serializer)
+        self.senders = {self.serializer: self.dashi}
+
+    def _sender(self, target):
+        serializer = self.serializers.get(target, self.serializer)
+        sender = self.senders.get(serializer)
+        if sender is None:
+            sender = self.senders[serializer] = self.connection(serializer=serializer)
+        return sender
+
+    def handle(self, func, name):
+        self.dashi.handle(func, name)
+
+    def fire(self, target, func, **kwargs):
+        self._sender(target).fire(target, func, **kwargs)
+
+    def call(self, target, func, **kwargs):
+        return self._sender(target).call(target, func, **kwargs)
+
+    def consume(self, timeout=None):
+        self.dashi.consume(timeout=timeout)
+
+
+class localtransport(transport):
+    """Transport over in memory queues for the queues consumed by this process, for
+    single host deployments and tests. Messages to other queues, ie: the queues of the
+    modules running in their own process, are sent over the broker with a :class:`dashitransport`.
+    Arguments of local messages are passed to the handlers as is, without serialization.
+    A queue also receives the messages sent to it over the broker, these are handled by
+    the thread consuming the queue like local messages. Without an amqp_uri in the
+    exchange config all queues are in memory. Like an AMQP queue a queue exists until
+    the end of the process and a message waits in it until it is consumed, a forked
+    process starts without the queues of its parent. Errors of handlers of fired messages are logged
+    """
+    queues = {}
+    handlers = {}
+    lock = threading.Lock()
+    pid = None
+    logger = logging.getLogger('Transport')
+
+    def __init__(self, name, config):
+        transport.__init__(self, name, config)
+        self.remote = dashitransport(name, config) if config.get('amqp_uri') else None
+        self.receiver = None
+        self.receiving = None
+        self._inbox()
+
+    @classmethod
+    def _owned(cls):
+        """Returns the queues of this process, the lock must be held
+        """
+        if cls.pid != os.getpid():
+            cls.pid = os.getpid()
+            cls.queues = {}
+            cls.handlers = {}
+        return cls.queues
+
+    def _inbox(self):
+        """Returns the in memory queue consumed by this transport
+        """
+        with self.lock:
+            return self._owned().setdefault(self.name, qu.Queue())
+
+    def _queue(self, name):
+        """Returns the in memory queue of a queue name, None if the queue is consumed by another process
+        """
+        with self.lock:
+            queues = self._owned()
+            queue = queues.get(name)
+            if queue is None and self.remote is None:
+                queue = queues[name] = qu.Queue()
+            return queue
+
+    def handle(self, func, name):
+        with self.lock:
+            self.handlers.setdefault(self.name, {})[name] = func
+        if self.remote is not None:
+            if self.receiver is None:
+                # the broker connection of the queue is only used by the thread receiving from it
+                self.receiver = dashitransport(self.name, self.config)
+            self.receiver.handle(functools.partial(self._forward, name), name)
+
+    def fire(self, target, func, **kwargs):
+        queue = self._queue(target)
+        if queue is None:
+            self.remote.fire(target, func, **kwargs)
+        else:
+            queue.put((func, kwargs, None))
+
+    def call(self, target, func, timeout=5, **kwargs):
+        queue = self._queue(target)
+        if queue is None:
+            return self.remote.call(target, func, timeout=timeout, **kwargs)
+        reply = qu.Queue(1)
+        queue.put((func, kwargs, reply))
+        try:
+            error, result = reply.get(timeout=timeout)
+        except qu.Empty:
+            raise socket.timeout('no reply to {} from {}'.format(func, target))
+        if error is not None:
+            raise error
+        return result
+
+    def _forward(self, func, **kwargs):
+        """Pass a message received over the broker to the thread consuming the queue and return its reply
+        """
+        reply = qu.Queue(1)
+        self._inbox().put((func, kwargs, reply))
+        error, result = reply.get()
+        if error is not None:
+            raise error
+        return result
+
+    def _receive(self):
+        while True:
+            try:
+                self.receiver.consume(timeout=2)
+            except socket.timeout:
+                pass
+
+    def _dispatch(self, func, kwargs, reply):
+        with self.lock:
+            handler = self.handlers.get(self.name, {}).get(func)
+        error, result = None, None
+        if handler is None:
+            error = LookupError('{} has no handler for {}'.format(self.name, func))
+        else:
+            try:
+                result = handler(**kwargs)
+            except Exception as err:
+                error = err
+        if reply is not None:
+            reply.put((error, result))
+        elif error is not None:
+            self.logger.error('Handling {} on {} failed: {}'.format(func, self.name, error), exc_info=error)
+
+    def consume(self, timeout=None):
+        if self.receiver is not None and self.receiving is None:
+            self.receiving = threading.Thread(target=self._receive, name='{}-broker'.format(self.name), daemon=True)
+            self.receiving.start()
+        queue = self._inbox()
+        while True:
+            try:
+                message = queue.get(timeout=timeout)
+            except qu.Empty:
+                raise socket.timeout()
+            self._dispatch(*message)
+
+
+transports = {'dashi': dashitransport,
+              'local': localtransport}
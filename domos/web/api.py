@@ -7,10 +7,7 @@ import json
 
 
 def getmodules():
-    db = dbhandler(domosSettings.getDBConfig())
-    db.connect()
     modules = Module.list()
-    db.close()
     ret = []
     for module in modules:
         print(module)
@@ -22,12 +19,24 @@ def getmodules():
 class API:
     def __init__(self, app):
         self.app = app
+        self.db = dbhandler(domosSettings.getDBConfig())
+        self.app.before_request(self.connect)
+        self.app.teardown_request(self.close)
         self.app.add_url_rule('/api/getmodules', 'getmodules', getmodules, methods=['GET'])
         self.app.add_url_rule('/api/getmodule/<int:module_id>', 'getmodule', self.getmodule, methods=['GET'])
 
+    def connect(self):
+        """Take a database connection from the pool for the request
+        """
+        self.db.connect()
+
+    def close(self, exception):
+        """Return the database connection of the request to the pool
+        """
+        if not dbconn.is_closed():
+            self.db.close()
+
     def getmodule(self, module_id):
-        db = dbhandler(domosSettings.getDBConfig())
-        db.connect()
         try:
             module = Module.get_by_id(module_id)
         except DoesNotExist:
@@ -1,6 +1,6 @@
 from dashi import DashiConnection
 from threading import Thread
-from domos.util.rpc import rpc
+from domos.util.rpc import rpc, sensorbatch
 import socket
 import domos
 
@@ -21,6 +21,7 @@ class DashiThread(Thread):
         Thread.__init__(self)
         self.name = "shellsensor"
         self.rpc = rpc(self.name)
+        self.values = sensorbatch(self.rpc)
         self.done = False
         self.identifier = None
         self.key = None
@@ -44,10 +45,7 @@ class DashiThread(Thread):
     def sendvalue(self, value):
         if self.addaccepted:
             self.rpc.log_debug("sending: " + str(value))
-            self.rpc.fire("domoscore",
-                          "sensorValue",
-                          key=self.key,
-                          value=value)
+            self.values.put(self.key, value)
 
     def addshellinput(self, key=None, name=None, prompt=">>"):
         self.identifier = name
@@ -66,6 +64,7 @@ class DashiThread(Thread):
             self.rpc.listen()
 
     def end(self):
+        self.values.flush()
         self.done = True
 
 